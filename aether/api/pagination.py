@@ -0,0 +1,7 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """Paginates by seeking past the last seen id, without COUNT(*) queries"""
+
+    ordering = "id"
@@ -1,5 +1,5 @@
 from django.contrib.auth.models import User
-from rest_framework.serializers import ModelSerializer
+from rest_framework.serializers import FloatField, ModelSerializer
 
 from aether.forum.models import ForumPost, ForumPostEdit, ForumUser
 
@@ -31,3 +31,10 @@ class ForumPostSerializer(ModelSerializer):
     class Meta:
         model = ForumPost
         fields = ("id", "thread", "user", "edits", "message", "created_at")
+
+
+class ForumPostSearchSerializer(ForumPostSerializer):
+    rank = FloatField(read_only=True)
+
+    class Meta(ForumPostSerializer.Meta):
+        fields = ForumPostSerializer.Meta.fields + ("rank",)
@@ -1,23 +1,48 @@
-from django.contrib.auth.models import User
-from django.db.models import Exists, OuterRef, Q
+import hashlib
+
+from django.db.models import F, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
 from aether.forum.models import ForumPost
+from aether.forum.permissions import get_board_access
+from aether.utils.search import search
 
-from .serializers import ForumPostSerializer
+from .pagination import IdCursorPagination
+from .serializers import ForumPostSearchSerializer, ForumPostSerializer
 
 
 class ForumPostViewSet(ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     serializer_class = ForumPostSerializer
+    pagination_class = IdCursorPagination
+
+    def get_base_queryset(self):
+        """Posts visible to the user, without the related data needed for serialization"""
+        readable = get_board_access(self.request.user).readable
+        qs = ForumPost.objects.filter(deleted=False, thread__board__in=readable)
+
+        # For incremental sync, only return posts newer than the given one
+        since_id = self.request.query_params.get("since_id")
+        if since_id is not None:
+            try:
+                qs = qs.filter(id__gt=int(since_id))
+            except ValueError:
+                raise ValidationError({"since_id": "A valid integer is required."})
+        return qs
 
     def get_queryset(self):
-        qs = (
-            ForumPost.objects.select_related("user", "user__profile")
+        return (
+            self.get_base_queryset()
+            .select_related("user", "user__profile")
             .prefetch_related("edits")
-            .filter(deleted=False)
             .defer(
+                "search_vector",
                 "user__first_name",
                 "user__last_name",
                 "user__email",
@@ -28,20 +53,66 @@ class ForumPostViewSet(ReadOnlyModelViewSet):
             )
         )
 
-        user = self.request.user
-        if user and user.is_authenticated:
-            subq = (
-                User.objects.filter(pk=user.id)
-                .filter(
-                    Q(is_superuser=True)
-                    | Q(groups__permissions__codename=OuterRef("thread__board__read_perm__codename"))
-                )
-                .values("pk")
+    def get_version_queryset(self):
+        """Only the values that change the serialized posts, for computing validators"""
+        return (
+            self.get_base_queryset()
+            .only("id", "edit_version")
+            .annotate(
+                profile_version=F("user__profile__profile_version"), edited_at=Max("edits__created_at")
             )
-            qs = qs.annotate(can_read=Exists(subq)).filter(
-                Q(thread__board__read_perm=None) | Q(can_read=True)
+        )
+
+    @staticmethod
+    def get_etag(posts, *extra) -> str:
+        """Returns the ETag of the given posts"""
+        digest = hashlib.sha1()
+        for post in posts:
+            digest.update(
+                "{}:{}:{}:{};".format(
+                    post.id, post.edit_version, post.profile_version, post.edited_at
+                ).encode()
             )
-        else:
-            qs = qs.filter(thread__board__read_perm=None)
+        for value in extra:
+            digest.update("{};".format(value).encode())
+        return quote_etag(digest.hexdigest())
 
-        return qs
+    def conditional_response(self, request, posts, *extra):
+        """Returns a 304 response if the client has the current posts, otherwise None"""
+        self.etag = self.get_etag(posts, *extra)
+        return get_conditional_response(request._request, etag=self.etag)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code in (200, 304) and getattr(self, "etag", None):
+            response["ETag"] = self.etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        # Paginate the light version rows first, so that unchanged pages are not loaded or serialized
+        page = self.paginate_queryset(self.filter_queryset(self.get_version_queryset()))
+        not_modified = self.conditional_response(
+            request, page, self.paginator.get_next_link(), self.paginator.get_previous_link()
+        )
+        if not_modified:
+            return not_modified
+        posts = self.get_queryset().in_bulk([post.id for post in page])
+        data = self.get_serializer([posts[post.id] for post in page if post.id in posts], many=True).data
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        post = get_object_or_404(self.get_version_queryset(), pk=kwargs["pk"])
+        not_modified = self.conditional_response(request, [post])
+        if not_modified:
+            return not_modified
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, serializer_class=ForumPostSearchSerializer, pagination_class=LimitOffsetPagination)
+    def search(self, request):
+        """Posts matching ?q=, best matches first"""
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise ValidationError({"q": "This parameter is required."})
+        qs = search(self.get_queryset().filter(thread__deleted=False), query, fallback_fields=("message",))
+        page = self.paginate_queryset(qs)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
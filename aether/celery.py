@@ -6,3 +6,16 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aether.settings")
 app = Celery("aether")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+
+@app.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+    # Scheduled here so that the final value from settings.py is used
+    from django.conf import settings
+
+    if settings.FORUM_VIEW_FLUSH_INTERVAL:
+        sender.add_periodic_task(
+            settings.FORUM_VIEW_FLUSH_INTERVAL,
+            sender.signature("aether.forum.tasks.flush_thread_views"),
+            name="flush-thread-views",
+        )
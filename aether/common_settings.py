@@ -20,6 +20,30 @@ CRISPY_TEMPLATE_PACK = "bootstrap4"
 FORUM_MESSAGE_LIMIT = 25
 FORUM_THREAD_LIMIT = 25
 
+# Use keyset pagination instead of OFFSET for thread and post listings
+FORUM_KEYSET_PAGINATION = True
+
+# Threads not modified within this many seconds are never shown as unread. Set to None to disable.
+FORUM_UNREAD_MAX_AGE = 3600 * 24 * 90
+
+# Rendered post blocks are cached for this many seconds. Set to None to disable the cache.
+FORUM_POST_CACHE_TIMEOUT = 3600 * 24
+
+# Thread view counters are collected to redis and written to the database every N seconds.
+# Set to None to write every view to the database directly.
+FORUM_VIEW_FLUSH_INTERVAL = 60
+
+# Repeated reads of the same thread by the same user within N seconds only update the last read
+# timestamp once, unless the thread was modified in between. Set to None to write on every read.
+FORUM_LAST_READ_COALESCE_SECONDS = 10
+
+# PostgreSQL text search configuration for post and news search. Posts are written in several languages,
+# so words are not stemmed by default. Run update_search_vectors --force after changing this.
+SEARCH_CONFIG = "simple"
+
+# Search results per page
+FORUM_SEARCH_LIMIT = 25
+
 # Upload limits
 FILE_UPLOAD_PERMISSIONS = 0o644
 DATA_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024 * 8
@@ -171,12 +195,19 @@ USE_TZ = True
 
 # BBCode downloader limits
 BBCODE_CACHE_IMAGE_MAX_SIZE = 8 * 1024 * 1024  # 8M
+BBCODE_CACHE_IMAGE_MAX_PIXELS = 40 * 1000 * 1000  # Checked from the header before decoding
 BBCODE_CACHE_IMAGE_MIME_TYPES = [
     "image/jpeg",
     "image/png",
     "image/gif",
     "image/webp",
 ]
+BBCODE_CACHE_FETCH_TIMEOUT = (10, 30)  # Connect and read timeouts per request
+BBCODE_CACHE_FETCH_DEADLINE = 180  # Total time for all downloads of a single postprocess task
+BBCODE_CACHE_FETCH_WORKERS = 8
+BBCODE_CACHE_FETCH_PER_HOST = 2
+BBCODE_CACHE_RETRY_DELAY = 3600  # First retry delay of a failed download, doubled on each failure
+BBCODE_CACHE_RETRY_MAX_DELAY = 3600 * 24 * 7
 
 # Set european looking datetime formatting
 DATE_FORMAT = "Y-m-d"
@@ -210,6 +241,9 @@ CACHES = {
 # Cache backend for imagekit
 IMAGEKIT_CACHE_BACKEND = "imagekit"
 
+# Generate AVIF variants of image renditions in addition to WebP. AVIF is smaller, but slow to encode.
+IMAGE_RENDITION_AVIF = False
+
 # Celery uses redis as broker
 CELERY_BROKER_URL = "redis://127.0.0.1:6379/11"
 CELERY_ACCEPT_CONTENT = ["application/json"]
@@ -5,6 +5,9 @@ from imagekit.admin import AdminThumbnail
 
 from .models import (
     BBCodeImage,
+    BBCodeImageBlob,
+    BBCodeImageFailure,
+    BBCodeImageReference,
     ForumBoard,
     ForumLastRead,
     ForumPost,
@@ -31,8 +34,29 @@ class UserAdmin(BaseUserAdmin):
 
 class BBCodeImageAdmin(admin.ModelAdmin):
     list_display = ("source_url", "created_at", "admin_thumbnail")
+    list_select_related = ("blob",)
+    admin_thumbnail = AdminThumbnail(image_field=lambda obj: obj.image.small)
+    readonly_fields = ("admin_thumbnail",)
+    raw_id_fields = ("blob",)
+    search_fields = ("source_url",)
+
+
+class BBCodeImageBlobAdmin(admin.ModelAdmin):
+    list_display = ("sha256", "created_at", "admin_thumbnail")
     admin_thumbnail = AdminThumbnail(image_field="small")
     readonly_fields = ("admin_thumbnail",)
+    search_fields = ("sha256",)
+
+
+class BBCodeImageFailureAdmin(admin.ModelAdmin):
+    list_display = ("source_url", "reason", "attempts", "permanent", "last_attempt_at", "next_retry_at")
+    list_filter = ("permanent",)
+    search_fields = ("source_url",)
+
+
+class BBCodeImageReferenceAdmin(admin.ModelAdmin):
+    list_display = ("source_url", "object_type", "object_id")
+    list_filter = ("object_type",)
     search_fields = ("source_url",)
 
 
@@ -81,6 +105,9 @@ admin.site.register(User, UserAdmin)
 
 # Everything else
 admin.site.register(BBCodeImage, BBCodeImageAdmin)
+admin.site.register(BBCodeImageBlob, BBCodeImageBlobAdmin)
+admin.site.register(BBCodeImageFailure, BBCodeImageFailureAdmin)
+admin.site.register(BBCodeImageReference, BBCodeImageReferenceAdmin)
 admin.site.register(ForumLastRead, ForumLastReadAdmin)
 admin.site.register(ForumPost, ForumPostAdmin)
 admin.site.register(ForumThread, ForumThreadAdmin)
@@ -1,13 +1,39 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 
 class ForumConfig(AppConfig):
     name = "aether.forum"
 
     def ready(self):
-        from .models import ForumPost, ForumUser
-        from .signals import postprocess_forumpost, postprocess_forumuser
+        from django.contrib.auth.models import Group, User
+
+        from aether.gallery.models import GalleryImage
+
+        from .models import BBCodeImage, ForumBoard, ForumPost, ForumThread, ForumUser
+        from .signals import (
+            generate_forumuser_renditions,
+            generate_galleryimage_renditions,
+            invalidate_board_access,
+            invalidate_board_pages,
+            postprocess_forumpost,
+            postprocess_forumuser,
+            refresh_forumpost_counters,
+            rerender_deleted_image,
+            update_forumpost_search_vector,
+        )
 
         post_save.connect(postprocess_forumuser, sender=ForumUser)
+        post_save.connect(generate_forumuser_renditions, sender=ForumUser)
+        post_save.connect(generate_galleryimage_renditions, sender=GalleryImage)
         post_save.connect(postprocess_forumpost, sender=ForumPost)
+        post_save.connect(refresh_forumpost_counters, sender=ForumPost)
+        post_save.connect(update_forumpost_search_vector, sender=ForumPost)
+        post_delete.connect(rerender_deleted_image, sender=BBCodeImage)
+        post_save.connect(invalidate_board_pages, sender=ForumThread)
+        post_save.connect(invalidate_board_access, sender=ForumBoard)
+        post_delete.connect(invalidate_board_access, sender=ForumBoard)
+        post_delete.connect(invalidate_board_access, sender=Group)
+        m2m_changed.connect(invalidate_board_access, sender=Group.permissions.through)
+        m2m_changed.connect(invalidate_board_access, sender=User.groups.through)
+        m2m_changed.connect(invalidate_board_access, sender=User.user_permissions.through)
@@ -0,0 +1,59 @@
+import contextlib
+import contextvars
+import re
+import typing
+
+from aether.forum.models import BBCodeImage
+from aether.utils.misc import LRUCache
+
+# Kept apart from bbcode_tags, which can not be imported during app initialization
+
+match_img_url = re.compile(r"\[img\](\s*)(.+?)(\s*)\[\/img\]")
+
+# Resolved (original url, renditions) of cached images, by source url
+image_url_cache = LRUCache(maxsize=4096, ttl=300)
+
+# Images resolved for the current render pass. Unlike the LRU, this also remembers missing images.
+image_render_urls = contextvars.ContextVar("image_render_urls", default=None)
+
+
+def _image_urls(entry: BBCodeImage) -> typing.Tuple[str, dict]:
+    if entry.blob_id and "medium" in entry.blob.renditions:
+        return entry.blob.original.url, entry.blob.renditions
+    return entry.image.original.url, {"medium": {"url": entry.image.medium.url}}
+
+
+def lookup_image(url: str) -> typing.Optional[typing.Tuple[str, dict]]:
+    resolved = image_render_urls.get()
+    if resolved is not None and url in resolved:
+        return resolved[url]
+    urls = image_url_cache.get(url)
+    if urls is None:
+        entry = BBCodeImage.objects.select_related("blob").filter(source_url=url).first()
+        if entry:
+            urls = _image_urls(entry)
+            image_url_cache.set(url, urls)
+    return urls
+
+
+@contextlib.contextmanager
+def image_render_context(*texts: str):
+    """Resolves the images embedded in the given raw BBCode texts with a single query"""
+    urls = {hit[1].strip() for text in texts for hit in match_img_url.findall(text)}
+    resolved = {}
+    for url in urls:
+        cached = image_url_cache.get(url)
+        if cached is not None:
+            resolved[url] = cached
+    missing = urls - resolved.keys()
+    for url in missing:
+        resolved[url] = None
+    if missing:
+        for entry in BBCodeImage.objects.select_related("blob").filter(source_url__in=missing):
+            resolved[entry.source_url] = _image_urls(entry)
+            image_url_cache.set(entry.source_url, resolved[entry.source_url])
+    token = image_render_urls.set(resolved)
+    try:
+        yield
+    finally:
+        image_render_urls.reset(token)
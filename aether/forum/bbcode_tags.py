@@ -1,9 +1,30 @@
+import hashlib
+from importlib.metadata import version
+from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
+from django.utils.safestring import mark_safe
 from precise_bbcode.bbcode.tag import BBCodeTag
+from precise_bbcode.models import BBCodeTag as CustomBBCodeTag
+from precise_bbcode.models import SmileyTag
 from precise_bbcode.tag_pool import tag_pool
 
-from aether.forum.models import BBCodeImage
+from aether.forum import bbcode_images
+from aether.forum.bbcode_images import lookup_image
+from aether.utils.renditions import picture_html
+
+
+def get_render_version() -> str:
+    """Returns a hash of everything that affects rendered BBCode"""
+    h = hashlib.sha256()
+    h.update(version("django-precise-bbcode").encode())
+    h.update(Path(__file__).read_bytes())
+    h.update(Path(bbcode_images.__file__).read_bytes())
+    for row in CustomBBCodeTag.objects.order_by("id").values_list():
+        h.update(repr(row).encode())
+    for row in SmileyTag.objects.order_by("id").values_list():
+        h.update(repr(row).encode())
+    return h.hexdigest()[:16]
 
 
 class YoutubeTag(BBCodeTag):
@@ -54,11 +75,10 @@ class ImageTag(BBCodeTag):
 
     def render(self, value, option=None, parent=None):
         url = value.strip()
-        entry = BBCodeImage.objects.filter(source_url=url).first()
-        medium_url = entry.medium.url if entry else url
-        original_url = entry.original.url if entry else url
-        return '<a href="{}" data-featherlight="image" class="fl-image"><img src="{}" /></a>'.format(
-            original_url, medium_url
+        # Tag contents are already escaped by the parser
+        original_url, renditions = lookup_image(url) or (url, {"medium": {"url": mark_safe(url)}})
+        return '<a href="{}" data-featherlight="image" class="fl-image">{}</a>'.format(
+            original_url, picture_html(renditions, "medium")
         )
 
 
@@ -4,6 +4,7 @@ from django.db import transaction
 from django.forms import CharField, Form, ModelForm, Textarea
 from django.utils.translation import gettext_lazy as _
 
+from .bbcode_images import image_render_context
 from .models import ForumBoard, ForumPost, ForumPostEdit, ForumThread
 
 
@@ -34,7 +35,8 @@ class NewThreadForm(ModelForm):
         post.thread = thread
         post.user = self.user
         if commit:
-            post.save()
+            with image_render_context(post.message.raw):
+                post.save()
         return post
 
     class Meta:
@@ -64,7 +66,8 @@ class NewMessageForm(ModelForm):
         post.user = self.user
         post.thread = self.thread
         if commit:
-            post.save()
+            with image_render_context(post.message.raw):
+                post.save()
         return post
 
     class Meta:
@@ -75,12 +78,22 @@ class NewMessageForm(ModelForm):
 class MoveThreadForm(ModelForm):
     def __init__(self, *args, **kwargs):
         super(MoveThreadForm, self).__init__(*args, **kwargs)
+        self.original_board = self.instance.board if self.instance.board_id else None
         self.fields["board"].queryset = ForumBoard.objects.filter(deleted=False).order_by(
             "section__sort_index", "sort_index"
         )
         self.helper = FormHelper()
         self.helper.add_input(Submit("submit", _("Post")))
 
+    @transaction.atomic
+    def save(self, commit=True):
+        thread = super(MoveThreadForm, self).save(commit)
+        if commit:
+            thread.board.refresh_counters()
+            if self.original_board and self.original_board.id != thread.board_id:
+                self.original_board.refresh_counters()
+        return thread
+
     class Meta:
         model = ForumThread
         fields = ("board",)
@@ -108,7 +121,9 @@ class EditMessageForm(ModelForm):
         self.helper.add_input(Submit("submit", _("Post")))
 
     def save(self, commit=True):
-        post = super(EditMessageForm, self).save(commit)
+        self.instance.edit_version += 1
+        with image_render_context(self.cleaned_data["message"]):
+            post = super(EditMessageForm, self).save(commit)
         if self.instance.is_first:
             self.instance.thread.title = self.cleaned_data["title"]
             if commit:
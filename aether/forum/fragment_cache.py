@@ -0,0 +1,53 @@
+import typing
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+STATS_HITS_KEY = "forum:post_cache:hits"
+STATS_MISSES_KEY = "forum:post_cache:misses"
+
+
+class PostFragmentCache:
+    """Cache for the rendered post blocks of a thread page, fetched with a single lookup"""
+
+    def __init__(self, posts: typing.Iterable, parts: typing.Iterable[str]):
+        tz = timezone.get_current_timezone_name()
+        self.keys = {(post.id, part): self.make_key(post, part, tz) for post in posts for part in parts}
+        self.fragments = cache.get_many(list(self.keys.values()))
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(post, part: str, tz: str) -> str:
+        return "forum:post_cache:{}:{}:{}:{}:{}".format(
+            post.id, part, post.edit_version, post.user.profile.profile_version, tz
+        )
+
+    def get(self, post, part: str) -> typing.Optional[str]:
+        fragment = self.fragments.get(self.keys.get((post.id, part)))
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return fragment
+
+    def set(self, post, part: str, fragment: str) -> None:
+        key = self.keys.get((post.id, part))
+        if key:
+            cache.set(key, fragment, timeout=settings.FORUM_POST_CACHE_TIMEOUT)
+
+    def save_stats(self) -> None:
+        for key, value in ((STATS_HITS_KEY, self.hits), (STATS_MISSES_KEY, self.misses)):
+            if value:
+                cache.add(key, 0, timeout=None)
+                cache.incr(key, value)
+
+    @staticmethod
+    def get_stats() -> dict:
+        values = cache.get_many([STATS_HITS_KEY, STATS_MISSES_KEY])
+        return {"hits": values.get(STATS_HITS_KEY, 0), "misses": values.get(STATS_MISSES_KEY, 0)}
+
+    @staticmethod
+    def reset_stats() -> None:
+        cache.delete_many([STATS_HITS_KEY, STATS_MISSES_KEY])
@@ -1,11 +1,19 @@
 import re
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from precise_bbcode.bbcode import get_parser
 
-from aether.forum.models import ForumPost, ForumUser
-from aether.main_site.models import NewsItem
+from aether.forum import tasks
+from aether.forum.bbcode_images import image_render_context
+from aether.forum.tasks import BBCODE_OBJECTS
 
-re_urlimg = re.compile(r"\[url=(.+?)\]\[img\](\s*)(.+?)(\s*)\[\/img\]\[\/url\]")
+# The captures must not contain brackets, so that a match can not span other tags in the text
+re_urlimg = re.compile(r"\[url=([^\]]+?)\]\[img\](\s*)([^\[]+?)(\s*)\[\/img\]\[\/url\]")
+
+# Every match of re_urlimg contains this, so it is used to find the candidate rows in the database
+CANDIDATE_MARKER = "[/img][/url]"
 
 
 def rfn(m):
@@ -13,18 +21,68 @@ def rfn(m):
 
 
 class Command(BaseCommand):
+    help = "Replace [url=x][img]y[/img][/url] with [img]x[/img] in news items, signatures and forum posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Rows rewritten per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be changed")
+
+    def rewrite_chunk(self, object_type, ids, dry_run):
+        """Rewrite, re-render and save a chunk of rows. Returns the numbers of changed rows and tags."""
+        model, field_name, version_field = BBCODE_OBJECTS[object_type]
+        rendered_field = "_{}_rendered".format(field_name)
+        parser = get_parser()
+        with transaction.atomic():
+            rows = model.objects.select_for_update().filter(pk__in=ids).values_list("pk", field_name)
+            changed = {}
+            tags = 0
+            for pk, raw in rows:
+                text, count = re_urlimg.subn(rfn, raw)
+                if count:
+                    changed[pk] = text
+                    tags += count
+            if dry_run or not changed:
+                return len(changed), tags
+
+            items = []
+            with image_render_context(*changed.values()):
+                for pk, text in changed.items():
+                    item = model(pk=pk)
+                    setattr(item, field_name, text)
+                    setattr(item, rendered_field, parser.render(text))
+                    if version_field:
+                        setattr(item, version_field, F(version_field) + 1)
+                    items.append(item)
+            fields = [field_name, rendered_field] + ([version_field] if version_field else [])
+            model.objects.bulk_update(items, fields)
+
+            # bulk_update sends no signals, so queue the new image urls for downloading explicitly
+            pks = list(changed)
+            transaction.on_commit(lambda: tasks.postprocess_many.apply_async((object_type, pks)))
+            return len(changed), tags
+
     def handle(self, *args, **options):
-        for item in NewsItem.objects.all():
-            if re_urlimg.match(item.message.raw):
-                item.message = re_urlimg.sub(rfn, item.message.raw)
-                item.save(update_fields=["_message_rendered", "message"])
-
-        for item in ForumUser.objects.all():
-            if re_urlimg.match(item.signature.raw):
-                item.signature = re_urlimg.sub(rfn, item.signature.raw)
-                item.save(update_fields=["_signature_rendered", "signature"])
-
-        for item in ForumPost.objects.all():
-            if re_urlimg.match(item.message.raw):
-                item.message = re_urlimg.sub(rfn, item.message.raw)
-                item.save(update_fields=["_message_rendered", "message"])
+        chunk_size = options["chunk_size"]
+        for object_type, (model, field_name, _) in BBCODE_OBJECTS.items():
+            candidates = (
+                model.objects.filter(**{"{}__contains".format(field_name): CANDIDATE_MARKER})
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            rows = 0
+            tags = 0
+            chunk = []
+            for pk in candidates.iterator(chunk_size=chunk_size):
+                chunk.append(pk)
+                if len(chunk) >= chunk_size:
+                    changed = self.rewrite_chunk(object_type, chunk, options["dry_run"])
+                    rows, tags = rows + changed[0], tags + changed[1]
+                    chunk = []
+            if chunk:
+                changed = self.rewrite_chunk(object_type, chunk, options["dry_run"])
+                rows, tags = rows + changed[0], tags + changed[1]
+            print(
+                "{}: {} {} rows, {} tags".format(
+                    object_type, "would change" if options["dry_run"] else "changed", rows, tags
+                )
+            )
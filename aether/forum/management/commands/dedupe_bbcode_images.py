@@ -0,0 +1,74 @@
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from aether.forum.bbcode_images import image_url_cache
+from aether.forum.models import BBCodeImage, BBCodeImageBlob
+
+
+class Command(BaseCommand):
+    help = (
+        "Move per-url BBCode image files to content addressed blobs, and remove unused blobs. "
+        "Rendered texts still point to the old files until regenerate_bbcode is run, after which the old "
+        "files can be removed with --delete-originals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete-originals",
+            action="store_true",
+            help="Delete the per-url files of images that have already been moved to blobs",
+        )
+
+    def handle(self, *args, **options):
+        existing = set(BBCodeImageBlob.objects.values_list("id", flat=True))
+        new_blobs = {}
+        moved = 0
+        moved_size = 0
+
+        entries = BBCodeImage.objects.filter(blob__isnull=True).exclude(original="").order_by("id")
+        for entry in entries.iterator():
+            try:
+                size = entry.original.size
+                with entry.original.open("rb") as fd:
+                    blob = BBCodeImageBlob.from_file(fd, os.path.splitext(entry.original.name)[1])
+            except OSError as e:
+                print("Unable to read {}: {}".format(entry.original.name, e))
+                continue
+            if blob.id not in existing:
+                new_blobs[blob.id] = size
+            entry.blob = blob
+            entry.save(update_fields=["blob"])
+            image_url_cache.delete(entry.source_url)
+            moved += 1
+            moved_size += size
+
+        print(
+            "Moved {} images ({:.1f} MB) to {} new blobs ({:.1f} MB).".format(
+                moved, moved_size / 1024 / 1024, len(new_blobs), sum(new_blobs.values()) / 1024 / 1024
+            )
+        )
+
+        if options["delete_originals"]:
+            legacy = BBCodeImage.objects.exclude(original="")
+            references = Counter(legacy.values_list("original", flat=True))
+            deleted = 0
+            for entry in legacy.filter(blob__isnull=False).order_by("id").iterator():
+                # Files may be shared by rows that have not been moved yet
+                references[entry.original.name] -= 1
+                if not references[entry.original.name]:
+                    for image in (entry.medium, entry.small):
+                        image.storage.delete(image.name)
+                    entry.original.delete(save=False)
+                    deleted += 1
+                entry.original = ""
+                entry.save(update_fields=["original"])
+            print("Deleted {} per-url image files.".format(deleted))
+
+        removed = 0
+        for blob in BBCodeImageBlob.objects.filter(images__isnull=True).iterator():
+            blob.delete_files()
+            blob.delete()
+            removed += 1
+        print("Removed {} unused blobs.".format(removed))
@@ -9,24 +9,30 @@ match_url = re.compile(r"\[img\](\s*)(.+?)(\s*)\[\/img\]")
 
 
 class Command(BaseCommand):
+    help = "Find embedded images whose address contains the given fragment"
+
     def add_arguments(self, parser):
-        parser.add_argument("-u", "--url", dest="url", type=str, help="Address fragment to look for")
+        parser.add_argument(
+            "-u", "--url", dest="url", type=str, required=True, help="Address fragment to look for"
+        )
+
+    def find(self, queryset, field_name, url, *fields):
+        """Stream the rows whose raw text contains the fragment"""
+        rows = queryset.filter(**{"{}__contains".format(field_name): url}).values_list(field_name, *fields)
+        for raw, *values in rows.iterator():
+            for entry in match_url.findall(raw):
+                if url in entry[1]:
+                    yield entry[1], values
 
     def handle(self, *args, **options):
-        for item in NewsItem.objects.all():
-            entries = match_url.findall(item.message.raw)
-            for entry in entries:
-                if options["url"] in entry[1]:
-                    print(f"News {item.id}: {entry[1]}")
-
-        for item in ForumUser.objects.all():
-            entries = match_url.findall(item.signature.raw)
-            for entry in entries:
-                if options["url"] in entry[1]:
-                    print(f"User {item.user.username}: {entry[1]}")
-
-        for item in ForumPost.objects.iterator():
-            entries = match_url.findall(item.message.raw)
-            for entry in entries:
-                if options["url"] in entry[1]:
-                    print(f"Thread {item.thread_id} post {item.id}: {entry[1]}")
+        url = options["url"]
+        for found, (item_id,) in self.find(NewsItem.objects.all(), "message", url, "id"):
+            print(f"News {item_id}: {found}")
+
+        for found, (username,) in self.find(ForumUser.objects.all(), "signature", url, "user__username"):
+            print(f"User {username}: {found}")
+
+        for found, (thread_id, item_id) in self.find(
+            ForumPost.objects.all(), "message", url, "thread_id", "id"
+        ):
+            print(f"Thread {thread_id} post {item_id}: {found}")
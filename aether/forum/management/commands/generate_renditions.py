@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from aether.forum import tasks
+from aether.forum.models import BBCodeImageBlob, ForumUser
+from aether.gallery.models import GalleryImage
+from aether.utils.renditions import needs_renditions
+
+
+class Command(BaseCommand):
+    help = "Queue rendition generation for avatars, gallery images and bbcode images that are missing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="Regenerate renditions even if they are up to date"
+        )
+
+    def handle(self, *args, **options):
+        for object_type, model in (
+            ("forumuser", ForumUser),
+            ("galleryimage", GalleryImage),
+            ("bbcodeimageblob", BBCodeImageBlob),
+        ):
+            count = 0
+            for obj in model.objects.only("id", model.rendition_source, "renditions").iterator():
+                if options["force"] or needs_renditions(obj):
+                    tasks.generate_renditions.apply_async((object_type, obj.id))
+                    count += 1
+            print("Queued {} {} objects".format(count, object_type))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from aether.forum.fragment_cache import PostFragmentCache
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the rendered post block cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", dest="reset", action="store_true", help="Reset counters after showing"
+        )
+
+    def handle(self, *args, **options):
+        stats = PostFragmentCache.get_stats()
+        total = stats["hits"] + stats["misses"]
+        ratio = stats["hits"] / total * 100 if total else 0
+        print(f"Hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {ratio:.1f}%")
+        if options["reset"]:
+            PostFragmentCache.reset_stats()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from aether.forum.models import ForumBoard
+
+
+class Command(BaseCommand):
+    help = "Rebuild denormalized post/thread counters and latest posts for all threads and boards"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            ForumBoard.rebuild_all_counters()
+        print("Counters rebuilt.")
@@ -1,38 +1,109 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, connections, transaction
+from django.db.models import F, Max, Min
 from precise_bbcode.bbcode import get_parser
 
-from aether.forum.models import ForumPost, ForumUser
-from aether.main_site.models import NewsItem
+from aether.forum.bbcode_images import image_render_context
+from aether.forum.bbcode_tags import get_render_version
+from aether.forum.tasks import BBCODE_OBJECTS
+
+CHECKPOINT_KEY = "bbcode:regenerate:{}:{}"
+
+
+def init_worker():
+    django.setup()
+    connections.close_all()
+
+
+def render_chunk(target: str, start: int, end: int, render_version: str, force: bool) -> int:
+    """Render the rows start <= id < end of a target in one transaction. Returns the number of rows updated."""
+    model, field_name, version_field = BBCODE_OBJECTS[target]
+    rendered_field = "_{}_rendered".format(field_name)
+    parser = get_parser()
+    with transaction.atomic():
+        items = model.objects.select_for_update().filter(id__gte=start, id__lt=end)
+        if not force:
+            items = items.exclude(render_version=render_version)
+        items = list(items.only("id", field_name, rendered_field))
+        if not items:
+            return 0
+        with image_render_context(*[getattr(item, field_name).raw for item in items]):
+            for item in items:
+                setattr(item, rendered_field, parser.render(getattr(item, field_name).raw))
+                item.render_version = render_version
+                if version_field:
+                    setattr(item, version_field, F(version_field) + 1)
+        update_fields = [rendered_field, "render_version"] + ([version_field] if version_field else [])
+        model.objects.bulk_update(items, update_fields)
+    return len(items)
 
 
 class Command(BaseCommand):
+    help = (
+        "Re-render stored BBCode of news items, signatures and forum posts. Rows already rendered with the "
+        "current tag set are skipped, and an interrupted run resumes from where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Number of worker processes")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Id range rendered per transaction")
+        parser.add_argument(
+            "--force", action="store_true", help="Re-render rows even if they are up to date"
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore saved progress")
+
     def handle(self, *args, **options):
-        parser = get_parser()
-
-        with transaction.atomic():
-            count = 0
-            for item in NewsItem.objects.select_for_update():
-                item.message.rendered = parser.render(item.message.raw)
-                item.save(update_fields=["_message_rendered"])
-                count += 1
-                if count % 10 == 0:
-                    print("NewsItem:  {}".format(count))
-
-        with transaction.atomic():
-            count = 0
-            for item in ForumUser.objects.select_for_update():
-                item.signature.rendered = parser.render(item.signature.raw)
-                item.save(update_fields=["_signature_rendered"])
-                count += 1
-                if count % 100 == 0:
-                    print("ForumUser: {}".format(count))
-
-        with transaction.atomic():
-            count = 0
-            for item in ForumPost.objects.select_for_update():
-                item.message.rendered = parser.render(item.message.raw)
-                item.save(update_fields=["_message_rendered"])
-                count += 1
-                if count % 1000 == 0:
-                    print("ForumPost: {}".format(count))
+        render_version = get_render_version()
+        chunk_size = options["chunk_size"]
+        workers = options["workers"]
+        if connection.vendor == "sqlite" and workers > 1:
+            # SQLite allows only one writer, so parallel workers would fail with "database is locked"
+            print("SQLite database, using a single worker")
+            workers = 1
+        print("Render version: {}".format(render_version))
+
+        for target, (model, _, _) in BBCODE_OBJECTS.items():
+            key = CHECKPOINT_KEY.format(target, render_version)
+            if options["restart"] or options["force"]:
+                cache.delete(key)
+            bounds = model.objects.aggregate(first=Min("id"), last=Max("id"))
+            if bounds["first"] is None:
+                continue
+            start = max(bounds["first"], cache.get(key, 0))
+            chunks = list(range(start, bounds["last"] + 1, chunk_size))
+            if not chunks:
+                print("{}: already done".format(target))
+                continue
+
+            # Close connections so that worker processes do not share them
+            connections.close_all()
+            started = time.monotonic()
+            done = set()
+            checkpoint = start
+            updated = 0
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+                futures = {
+                    pool.submit(
+                        render_chunk, target, chunk, chunk + chunk_size, render_version, options["force"]
+                    ): chunk
+                    for chunk in chunks
+                }
+                for future in as_completed(futures):
+                    updated += future.result()
+                    done.add(futures[future])
+
+                    # Save progress up to the first chunk that has not been completed yet
+                    while checkpoint in done:
+                        checkpoint += chunk_size
+                    cache.set(key, checkpoint, timeout=None)
+                    print(
+                        "{}: {}/{} chunks, {} rows updated".format(target, len(done), len(chunks), updated)
+                    )
+
+            elapsed = time.monotonic() - started
+            print("{}: {} rows updated in {:.1f}s".format(target, updated, elapsed))
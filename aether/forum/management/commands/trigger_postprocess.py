@@ -1,17 +1,75 @@
-from django.core.management.base import BaseCommand
+from datetime import datetime, time
+from time import monotonic
 
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from aether.celery import app
 from aether.forum import tasks
 from aether.forum.models import ForumPost, ForumUser
 from aether.main_site.models import NewsItem
 
+IMG_TAG = "[img]"
+
+
+def parse_since(value):
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise CommandError("Invalid --since value {}, use YYYY-MM-DD or an ISO datetime".format(value))
+        since = datetime.combine(date, time.min)
+    return make_aware(since) if is_naive(since) else since
+
 
 class Command(BaseCommand):
+    help = "Queue image postprocessing for news items, signatures and forum posts that contain [img] tags"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            help="Only objects changed since this date. Signatures are selected by the last login of the user.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Number of objects per queued task")
+
+    def get_querysets(self, since):
+        news = NewsItem.objects.filter(message__contains=IMG_TAG)
+        users = ForumUser.objects.filter(signature__contains=IMG_TAG)
+        posts = ForumPost.objects.filter(message__contains=IMG_TAG)
+        if since:
+            news = news.filter(modified_at__gte=since)
+            users = users.filter(user__last_login__gte=since)
+            posts = posts.filter(Q(created_at__gte=since) | Q(edits__created_at__gte=since)).distinct()
+        return (("newsitem", news), ("forumuser", users), ("forumpost", posts))
+
     def handle(self, *args, **options):
-        for instance in NewsItem.objects.all():
-            tasks.postprocess.apply_async(("newsitem", instance.id))
+        since = parse_since(options["since"]) if options["since"] else None
+        batch_size = options["batch_size"]
+        started = monotonic()
+        total = 0
 
-        for instance in ForumUser.objects.all():
-            tasks.postprocess.apply_async(("forumuser", instance.id))
+        # Publish all tasks through a single broker connection
+        with app.producer_or_acquire() as producer:
+            for object_type, queryset in self.get_querysets(since):
+                count = 0
+                batch = []
+                for object_id in queryset.order_by("id").values_list("id", flat=True).iterator():
+                    batch.append(object_id)
+                    if len(batch) >= batch_size:
+                        tasks.postprocess_many.apply_async((object_type, batch), producer=producer)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    tasks.postprocess_many.apply_async((object_type, batch), producer=producer)
+                    count += len(batch)
+                print("{}: queued {} objects".format(object_type, count))
+                total += count
 
-        for instance in ForumPost.objects.all():
-            tasks.postprocess.apply_async(("forumpost", instance.id))
+        elapsed = monotonic() - started
+        print(
+            "Queued {} objects in {:.1f}s ({:.0f} objects/s)".format(
+                total, elapsed, total / max(elapsed, 0.001)
+            )
+        )
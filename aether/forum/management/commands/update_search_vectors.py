@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from aether.forum.models import ForumPost
+from aether.main_site.models import NewsItem
+from aether.utils.search import build_search_vector, is_supported
+
+# Model and the fields passed to its get_search_texts()
+TARGETS = {
+    "newsitem": (NewsItem, ("header", "message")),
+    "forumpost": (ForumPost, ("message",)),
+}
+
+
+class Command(BaseCommand):
+    help = "Fill in the full-text search vectors of news items and forum posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Id range updated per transaction")
+        parser.add_argument("--force", action="store_true", help="Update rows that already have a vector")
+
+    def handle(self, *args, **options):
+        if not is_supported():
+            raise CommandError("Full-text search requires PostgreSQL")
+        chunk_size = options["chunk_size"]
+
+        for target, (model, fields) in TARGETS.items():
+            started = time.monotonic()
+            queryset = model.objects.all()
+            if not options["force"]:
+                queryset = queryset.filter(search_vector__isnull=True)
+            bounds = queryset.aggregate(first=Min("id"), last=Max("id"))
+            if bounds["first"] is None:
+                print("{}: already done".format(target))
+                continue
+
+            updated = 0
+            for start in range(bounds["first"], bounds["last"] + 1, chunk_size):
+                with transaction.atomic():
+                    rows = queryset.filter(id__gte=start, id__lt=start + chunk_size).values_list(
+                        "id", *fields
+                    )
+                    items = []
+                    for pk, *values in rows:
+                        item = model(pk=pk)
+                        item.search_vector = build_search_vector(model.get_search_texts(*values))
+                        items.append(item)
+                    model.objects.bulk_update(items, ["search_vector"])
+                updated += len(items)
+                print("{}: {} rows updated".format(target, updated))
+            print("{}: {} rows updated in {:.1f}s".format(target, updated, time.monotonic() - started))
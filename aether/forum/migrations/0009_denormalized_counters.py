@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from aether.utils.misc import SQCount
+
+
+def fill_counters(apps, schema_editor):
+    ForumBoard = apps.get_model("forum", "ForumBoard")
+    ForumThread = apps.get_model("forum", "ForumThread")
+    ForumPost = apps.get_model("forum", "ForumPost")
+
+    posts_sq = ForumPost.objects.filter(thread=OuterRef("pk"), deleted=False)
+    ForumThread.objects.update(
+        post_count=SQCount(posts_sq.values("pk")),
+        latest_post=Subquery(posts_sq.order_by("-id").values("pk")[:1]),
+    )
+    threads_sq = ForumThread.objects.filter(board=OuterRef("pk"), deleted=False).order_by().values("board")
+    ForumBoard.objects.update(
+        thread_count=SQCount(threads_sq.values("pk")),
+        post_count=Coalesce(Subquery(threads_sq.annotate(posts=Sum("post_count")).values("posts")), 0),
+        latest_post=Subquery(threads_sq.annotate(latest=Max("latest_post")).values("latest")),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0008_alter_forumpost_attached_gallery"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumboard",
+            name="latest_post",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="forum.forumpost",
+            ),
+        ),
+        migrations.AddField(
+            model_name="forumboard",
+            name="post_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="forumboard",
+            name="thread_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="forumthread",
+            name="latest_post",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="forum.forumpost",
+            ),
+        ),
+        migrations.AddField(
+            model_name="forumthread",
+            name="post_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
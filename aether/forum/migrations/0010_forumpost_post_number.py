@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0009_denormalized_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumpost",
+            name="post_number",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE forum_forumpost SET post_number = numbered.n
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY thread_id ORDER BY id) AS n
+                FROM forum_forumpost WHERE deleted = false
+            ) AS numbered
+            WHERE forum_forumpost.id = numbered.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
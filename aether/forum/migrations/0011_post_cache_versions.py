@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0010_forumpost_post_number"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumpost",
+            name="edit_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="forumuser",
+            name="profile_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:49
+
+from django.db import migrations, models
+
+import aether.utils.misc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0011_post_cache_versions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BBCodeImageFailure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("source_url", models.URLField(unique=True)),
+                ("reason", models.CharField(blank=True, max_length=255)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("permanent", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(default=aether.utils.misc.utc_now)),
+                ("last_attempt_at", models.DateTimeField(default=aether.utils.misc.utc_now)),
+                ("next_retry_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name": "BBCode Image Failure",
+                "verbose_name_plural": "BBCode Image Failures",
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import aether.forum.models
+import aether.utils.misc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0012_bbcodeimagefailure"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BBCodeImageBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("created_at", models.DateTimeField(default=aether.utils.misc.utc_now)),
+                ("original", models.ImageField(upload_to=aether.forum.models.bbcode_blob_path)),
+            ],
+            options={
+                "verbose_name": "BBCode Image Blob",
+                "verbose_name_plural": "BBCode Image Blobs",
+            },
+        ),
+        migrations.AlterField(
+            model_name="bbcodeimage",
+            name="original",
+            field=models.ImageField(blank=True, upload_to="bbcode"),
+        ),
+        migrations.AddField(
+            model_name="bbcodeimage",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="images",
+                to="forum.bbcodeimageblob",
+            ),
+        ),
+    ]
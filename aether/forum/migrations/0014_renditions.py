@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0013_bbcodeimageblob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bbcodeimageblob",
+            name="renditions",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="forumuser",
+            name="renditions",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0014_renditions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="forumpost",
+            name="render_version",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+        migrations.AddField(
+            model_name="forumuser",
+            name="render_version",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("forum", "0015_render_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BBCodeImageReference",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("source_url", models.URLField(max_length=2048)),
+                ("object_type", models.CharField(max_length=16)),
+                ("object_id", models.PositiveIntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["object_type", "object_id"], name="forum_bbcod_object__86c3c5_idx")
+                ],
+                "unique_together": {("source_url", "object_type", "object_id")},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Trigram indexes make substring searches (LIKE '%...%') over raw BBCode texts use an index. These are
+# only available on PostgreSQL, so other databases fall back to sequential scans.
+INDEXES = (
+    ("forum_forumpost_message_trgm", "forum_forumpost", "message"),
+    ("forum_forumuser_signature_trgm", "forum_forumuser", "signature"),
+    ("main_site_newsitem_message_trgm", "main_site_newsitem", "message"),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)".format(
+                name, table, column
+            )
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("forum", "0016_bbcodeimagereference"),
+        ("main_site", "0004_render_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
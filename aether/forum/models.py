@@ -1,30 +1,45 @@
+import hashlib
 import math
 import typing
+from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import Permission, User
-from django.db import IntegrityError
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.core.files import File
+from django.db import IntegrityError, connection, transaction
 from django.db.models import (
     CASCADE,
     PROTECT,
     SET_NULL,
     BooleanField,
+    Case,
     CharField,
+    Count,
     DateTimeField,
     Exists,
+    F,
     ForeignKey,
     ImageField,
     Index,
     IntegerField,
+    JSONField,
+    Max,
     Model,
     OneToOneField,
     OuterRef,
     PositiveIntegerField,
+    Q,
     QuerySet,
     Subquery,
+    Sum,
     TextField,
     URLField,
+    Value,
+    When,
 )
+from django.db.models.functions import Coalesce, Greatest
 from django.utils.functional import cached_property
 from imagekit.models import ImageSpecField
 from imagekit.processors import ResizeToFill, ResizeToFit
@@ -32,8 +47,22 @@ from precise_bbcode.fields import BBCodeTextField
 from timezone_field import TimeZoneField
 
 from aether.gallery.models import GalleryGroup
-from aether.utils.misc import SQCount, utc_now
-from aether.utils.permissions import has_perm_obj
+from aether.utils.misc import SQCount, get_redis_connection_or_none, utc_now
+from aether.utils.renditions import refresh_renditions, rendition_fields
+from aether.utils.search import strip_bbcode
+
+VIEW_COUNTER_KEY = "forum:thread_views"
+VIEW_COUNTER_FLUSH_BATCH = 500
+BOARD_PAGE_VERSION_KEY = "forum:pages:board_version:{}"
+
+RENUMBER_POSTS_SQL = """
+UPDATE {table} SET post_number = numbered.n
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY thread_id ORDER BY id) AS n
+    FROM {table} WHERE deleted = false
+) AS numbered
+WHERE {table}.id = numbered.id
+"""
 
 
 class ForumUser(Model):
@@ -46,15 +75,30 @@ class ForumUser(Model):
     thread_limit = PositiveIntegerField(default=25)
     avatar = ImageField(upload_to="avatars", blank=True)
     avatar_thumbnail = ImageSpecField(source="avatar", processors=[ResizeToFill(150, 150)], format="PNG")
+    avatar_thumbnail_webp = ImageSpecField(
+        source="avatar", processors=[ResizeToFill(150, 150)], format="WEBP", options={"quality": 85}
+    )
+    avatar_thumbnail_avif = ImageSpecField(
+        source="avatar", processors=[ResizeToFill(150, 150)], format="AVIF", options={"quality": 70}
+    )
+    profile_version = PositiveIntegerField(default=0, null=False)  # Bumped when post cache must refresh
+    renditions = JSONField(default=dict, blank=True, null=False)  # Generated by tasks.generate_renditions
+    render_version = CharField(max_length=16, blank=True, default="")  # Set by regenerate_bbcode
 
-    def mark_all_read(self, user: User) -> None:
+    def mark_all_read(self) -> None:
         self.last_all_read = utc_now()
         self.save(update_fields=["last_all_read"])
-        ForumLastRead.objects.filter(user=user).delete()
 
     def __str__(self) -> str:
         return self.user.username
 
+    rendition_source = "avatar"
+    rendition_specs = ("avatar_thumbnail",)
+
+    def refresh_renditions(self) -> bool:
+        # Post author blocks are cached, so they need to be refreshed to show the new avatar
+        return refresh_renditions(self, profile_version=F("profile_version") + 1)
+
 
 class ForumSection(Model):
     title = CharField(max_length=128, null=False, blank=False)
@@ -64,64 +108,14 @@ class ForumSection(Model):
     def __str__(self) -> str:
         return self.title
 
-    def visible_boards(self, user: User = None) -> QuerySet:
-        qs = (
-            self.boards.filter(deleted=False)
-            .select_related("read_perm", "read_perm__content_type", "write_perm", "write_perm__content_type")
-            .order_by("sort_index")
-        )
-
-        # Post count for all posts on the board
-        post_count_sq = ForumPost.objects.filter(
-            thread__board=OuterRef("pk"), thread__deleted=False, deleted=False
-        ).values("pk")
-        qs = qs.annotate(total_posts=SQCount(post_count_sq))
-
-        # Thread count for the board
-        post_count_sq = ForumThread.objects.filter(board=OuterRef("pk"), deleted=False).values("pk")
-        qs = qs.annotate(total_threads=SQCount(post_count_sq))
-
-        # Latest post ID for the threads
-        latest_post_sq = (
-            ForumPost.objects.filter(thread__board=OuterRef("pk"), thread__deleted=False, deleted=False)
-            .order_by("-id")
-            .values("pk")[:1]
-        )
-        qs = qs.annotate(latest_post_id=Subquery(latest_post_sq))
-
-        # Find out if threads have new content since last visit
-        if user and user.is_authenticated:
-            limit_ts = user.profile.last_all_read
-            reads_sq = ForumLastRead.objects.filter(
-                user=user, thread=OuterRef("pk"), created_at__gt=OuterRef("modified_at")
-            ).values("thread")
-            threads_sq = (
-                ForumThread.objects.filter(board_id=OuterRef("pk"), deleted=False, modified_at__gt=limit_ts)
-                .exclude(pk__in=Subquery(reads_sq))
-                .values("pk")
-            )
-            qs = qs.annotate(new_posts_count=SQCount(threads_sq))
-
-        return qs
+    def visible_boards(self) -> QuerySet:
+        return self.boards.filter(deleted=False).order_by("sort_index")
 
     @staticmethod
     def get_latest_posts(ids: typing.List[int]) -> dict:
-        sq = ForumPost.objects.filter(thread__board=OuterRef("thread__board"), deleted=False).values("pk")
-        qs = (
-            ForumPost.objects.filter(pk__in=ids)
-            .select_related("user", "user__profile", "thread")
-            .annotate(post_count=SQCount(sq))
-        )
+        qs = ForumPost.objects.filter(pk__in=ids).select_related("user", "user__profile", "thread")
         return {x.id: x for x in qs.all()}
 
-    def can_read(self, user: User) -> bool:
-        for board in self.boards.filter(deleted=False):
-            if board.read_perm is None:
-                return True
-            if has_perm_obj(user, board.read_perm):
-                return True
-        return False
-
     class Meta:
         app_label = "forum"
         indexes = [
@@ -138,61 +132,64 @@ class ForumBoard(Model):
     write_perm = ForeignKey(Permission, on_delete=PROTECT, null=True, related_name="writable_boards")
     sort_index = IntegerField(default=0, null=False)
     deleted = BooleanField(default=False, null=False)
+    post_count = PositiveIntegerField(default=0, null=False)
+    thread_count = PositiveIntegerField(default=0, null=False)
+    latest_post = ForeignKey("ForumPost", on_delete=SET_NULL, null=True, blank=True, related_name="+")
 
     def __str__(self) -> str:
         return self.title
 
-    def can_read(self, user: User) -> bool:
-        if self.read_perm is None:
-            return True
-        return has_perm_obj(user, self.read_perm)
+    def get_page_version(self) -> int:
+        return cache.get_or_set(BOARD_PAGE_VERSION_KEY.format(self.pk), 1, timeout=None)
 
-    def can_write(self, user: User) -> bool:
-        if not user.is_authenticated:
-            return False
-        if self.write_perm is None:
-            return True
-        return has_perm_obj(user, self.write_perm)
-
-    def visible_threads(self, user: User = None) -> QuerySet:
-        qs = (
-            self.threads.filter(deleted=False)
-            .select_related("user", "user__profile")
-            .order_by("-sticky", "-modified_at")
+    @staticmethod
+    def bump_page_version(board_id: int) -> None:
+        """Invalidates the cached page boundaries of a board, eg. when the thread ordering changes."""
+        key = BOARD_PAGE_VERSION_KEY.format(board_id)
+        cache.add(key, 1, timeout=None)
+        cache.incr(key)
+
+    @transaction.atomic
+    def refresh_counters(self) -> None:
+        """Recalculate the counters of this board from its threads. Locks the board row."""
+        ForumBoard.objects.select_for_update().only("pk").get(pk=self.pk)
+        values = self.threads.filter(deleted=False).aggregate(
+            threads=Count("pk"),
+            posts=Coalesce(Sum("post_count"), 0),
+            latest=Max("latest_post"),
         )
+        self.thread_count = values["threads"]
+        self.post_count = values["posts"]
+        self.latest_post_id = values["latest"]
+        self.save(update_fields=["thread_count", "post_count", "latest_post"])
 
-        # Post count for the threads
-        post_count_sq = ForumPost.objects.filter(thread=OuterRef("pk"), deleted=False).values("pk")
-        qs = qs.annotate(total_posts=SQCount(post_count_sq))
-
-        # Latest post ID for the threads
-        latest_post_sq = (
-            ForumPost.objects.filter(thread=OuterRef("pk"), deleted=False).order_by("-id").values("pk")[:1]
+    @staticmethod
+    def rebuild_all_counters() -> None:
+        """Rebuild all post numbers, thread and board counters from scratch."""
+        ForumPost.renumber_all()
+        posts_sq = ForumPost.objects.filter(thread=OuterRef("pk"), deleted=False)
+        ForumThread.objects.update(
+            post_count=SQCount(posts_sq.values("pk")),
+            latest_post=Subquery(posts_sq.order_by("-id").values("pk")[:1]),
+        )
+        threads_sq = (
+            ForumThread.objects.filter(board=OuterRef("pk"), deleted=False).order_by().values("board")
+        )
+        ForumBoard.objects.update(
+            thread_count=SQCount(threads_sq.values("pk")),
+            post_count=Coalesce(Subquery(threads_sq.annotate(posts=Sum("post_count")).values("posts")), 0),
+            latest_post=Subquery(threads_sq.annotate(latest=Max("latest_post")).values("latest")),
         )
-        qs = qs.annotate(latest_post_id=Subquery(latest_post_sq))
-
-        # Find out if threads have new content since last visit
-        if user and user.is_authenticated:
-            limit_ts = user.profile.last_all_read
-            reads_sq = ForumLastRead.objects.filter(
-                user=user, thread=OuterRef("pk"), created_at__gt=OuterRef("modified_at")
-            ).values("thread")
-            threads_sq = (
-                ForumThread.objects.filter(pk=OuterRef("pk"), deleted=False, modified_at__gt=limit_ts)
-                .exclude(pk__in=Subquery(reads_sq))
-                .values("pk")
-            )
-            qs = qs.annotate(new_posts_count=SQCount(threads_sq))
 
-        return qs
+    def visible_threads(self) -> QuerySet:
+        return (
+            self.threads.filter(deleted=False)
+            .select_related("user", "user__profile")
+            .order_by("-sticky", "-modified_at", "id")
+        )
 
     def get_latest_posts(self, ids: typing.List[int]) -> dict:
-        sq = ForumPost.objects.filter(thread__board=self.pk, deleted=False).values("pk")
-        qs = (
-            ForumPost.objects.filter(pk__in=ids)
-            .select_related("user", "user__profile", "thread")
-            .annotate(post_count=SQCount(sq))
-        )
+        qs = ForumPost.objects.filter(pk__in=ids).select_related("user", "user__profile", "thread")
         return {x.id: x for x in qs.all()}
 
     class Meta:
@@ -213,13 +210,68 @@ class ForumThread(Model):
     sticky = BooleanField(default=False, null=False)
     closed = BooleanField(default=False, null=False)
     deleted = BooleanField(default=False, null=False)
+    post_count = PositiveIntegerField(default=0, null=False)
+    latest_post = ForeignKey("ForumPost", on_delete=SET_NULL, null=True, blank=True, related_name="+")
 
     def __str__(self) -> str:
         return self.title
 
+    @transaction.atomic
+    def refresh_counters(self) -> None:
+        """Recalculate the post counter and latest post of this thread. Locks the thread row."""
+        ForumThread.objects.select_for_update().only("pk").get(pk=self.pk)
+        values = self.posts.filter(deleted=False).aggregate(posts=Count("pk"), latest=Max("pk"))
+        self.post_count = values["posts"]
+        self.latest_post_id = values["latest"]
+        self.save(update_fields=["post_count", "latest_post"])
+
+    @transaction.atomic
+    def count_new_post(self, post: "ForumPost") -> None:
+        """Update the thread and board counters for a newly created post, without recounting."""
+        # Concurrent posts can commit in either order, so the latest post only moves forward
+        latest_post = Greatest(
+            Coalesce("latest_post", 0, output_field=IntegerField()), post.pk, output_field=IntegerField()
+        )
+        ForumThread.objects.filter(pk=self.pk).update(
+            post_count=F("post_count") + 1, latest_post=latest_post
+        )
+        self.refresh_from_db(fields=["post_count", "latest_post"])
+        if self.post_count == 1:
+            self.board.refresh_counters()
+        else:
+            ForumBoard.objects.filter(pk=self.board_id).update(
+                post_count=F("post_count") + 1, latest_post=latest_post
+            )
+        self.refresh_post_number(post)
+
+    @transaction.atomic
+    def refresh_post_number(self, post: "ForumPost") -> None:
+        """Assign or release the sequence number of a post after it was created, deleted or restored."""
+        if post.deleted and post.post_number:
+            self.posts.filter(deleted=False, post_number__gt=post.post_number).update(
+                post_number=F("post_number") - 1
+            )
+            post.post_number = 0
+        elif not post.deleted and not post.post_number:
+            if post.id == self.latest_post_id:
+                post.post_number = self.post_count
+            else:
+                post.post_number = self.posts.filter(deleted=False, id__lt=post.id).count() + 1
+                self.posts.filter(deleted=False, post_number__gte=post.post_number).update(
+                    post_number=F("post_number") + 1
+                )
+        else:
+            return
+        ForumPost.objects.filter(pk=post.pk).update(post_number=post.post_number)
+
     @property
     def visible_posts(self) -> QuerySet:
-        qs = self.posts.filter(deleted=False).select_related("user", "user__profile").order_by("id")
+        qs = (
+            self.posts.filter(deleted=False)
+            .select_related("user", "user__profile", "attached_gallery")
+            .defer("search_vector")
+            .order_by("id")
+        )
 
         # Find out if post has edits
         post_edit_sq = ForumPostEdit.objects.filter(post=OuterRef("pk")).values("pk")
@@ -229,21 +281,46 @@ class ForumThread(Model):
 
     @cached_property
     def last_post(self) -> QuerySet:
-        sq = self.posts.filter(deleted=False).values("pk")
         return (
-            self.posts.filter(deleted=False)
-            .select_related("user", "user__profile")
-            .annotate(post_count=SQCount(sq))
-            .order_by("-id")
-            .first()
+            self.posts.filter(deleted=False).select_related("user", "user__profile").order_by("-id").first()
         )
 
-    def has_new_content(self, user: User) -> bool:
+    @staticmethod
+    def add_view(thread_id: int) -> None:
+        """Increment the views counter of a thread, buffered in redis when available."""
+        conn = get_redis_connection_or_none() if settings.FORUM_VIEW_FLUSH_INTERVAL else None
+        if conn is not None:
+            conn.hincrby(VIEW_COUNTER_KEY, thread_id, 1)
+        else:
+            ForumThread.objects.filter(pk=thread_id).update(views=F("views") + 1)
+
+    @staticmethod
+    def flush_views() -> int:
+        """Write the buffered view counts to the database. Returns the number of threads updated."""
+        conn = get_redis_connection_or_none()
+        if conn is None:
+            return 0
+        flush_key = "{}:flushing".format(VIEW_COUNTER_KEY)
+        lock = conn.lock("{}:lock".format(VIEW_COUNTER_KEY), timeout=600)
+        if not lock.acquire(blocking=False):
+            return 0
         try:
-            last_read = ForumLastRead.objects.get(user=user, thread=self)
-        except ForumLastRead.DoesNotExist:
-            return False
-        return self.modified_at > last_read.created_at
+            # Leftovers of a failed flush are handled first, otherwise the live hash is swapped out
+            if not conn.exists(flush_key):
+                if not conn.exists(VIEW_COUNTER_KEY):
+                    return 0
+                conn.rename(VIEW_COUNTER_KEY, flush_key)
+
+            deltas = [(int(k), int(v)) for k, v in conn.hgetall(flush_key).items()]
+            for n in range(0, len(deltas), VIEW_COUNTER_FLUSH_BATCH):
+                batch = deltas[n : n + VIEW_COUNTER_FLUSH_BATCH]
+                ForumThread.objects.filter(pk__in=[k for k, _ in batch]).update(
+                    views=F("views") + Case(*[When(pk=k, then=Value(v)) for k, v in batch], default=Value(0))
+                )
+                conn.hdel(flush_key, *[k for k, _ in batch])
+            return len(deltas)
+        finally:
+            lock.release()
 
     def set_modified(self) -> None:
         self.modified_at = utc_now()
@@ -263,6 +340,10 @@ class ForumPost(Model):
     message = BBCodeTextField(null=False, blank=False)
     created_at = DateTimeField(default=utc_now, null=False)
     deleted = BooleanField(default=False, null=False)
+    post_number = PositiveIntegerField(default=0, null=False)  # Sequence in thread, 0 if deleted
+    edit_version = PositiveIntegerField(default=0, null=False)  # Bumped when post cache must refresh
+    render_version = CharField(max_length=16, blank=True, default="")  # Set by regenerate_bbcode
+    search_vector = SearchVectorField(null=True, editable=False)  # Set on save, see aether.utils.search
     attached_gallery = ForeignKey(
         GalleryGroup,
         on_delete=SET_NULL,
@@ -275,19 +356,32 @@ class ForumPost(Model):
     def __str__(self) -> str:
         return str(self.id)
 
+    @staticmethod
+    def renumber_all() -> None:
+        """Rebuild the per-thread sequence numbers of all posts from scratch."""
+        table = ForumPost._meta.db_table
+        ForumPost.objects.filter(deleted=True).update(post_number=0)
+        with connection.cursor() as cursor:
+            cursor.execute(RENUMBER_POSTS_SQL.format(table=table))
+
+    @staticmethod
+    def get_search_texts(message: str) -> typing.List[typing.Tuple[str, str]]:
+        return [(strip_bbcode(message), "B")]
+
+    def search_texts(self) -> typing.List[typing.Tuple[str, str]]:
+        return self.get_search_texts(self.message.raw)
+
     @property
     def visible_edits(self) -> QuerySet:
         return self.edits.exclude(message="").order_by("id")
 
     @property
     def is_first(self) -> bool:
-        return self.thread.visible_posts.first().id == self.id
+        return self.post_number == 1
 
-    def page_for(self, user: User, count: int = None) -> int:
+    def page_for(self, user: User) -> int:
         show_count = user.profile.message_limit if user.is_authenticated else settings.FORUM_MESSAGE_LIMIT
-        if not count:
-            count = self.thread.posts.filter(deleted=False).count()
-        return math.ceil(count / show_count)
+        return max(math.ceil(self.post_number / show_count), 1)
 
     class Meta:
         app_label = "forum"
@@ -323,20 +417,123 @@ class ForumLastRead(Model):
 
     @staticmethod
     def refresh_last_read(user, thread) -> None:
+        now = utc_now()
+
+        # Skip the write if a recently written timestamp is still newer than the thread
+        coalesce = settings.FORUM_LAST_READ_COALESCE_SECONDS
+        if coalesce:
+            key = "forum:last_read:{}:{}".format(user.id, thread.id)
+            written = cache.get(key)
+            if written is not None and written > thread.modified_at:
+                return
+            cache.set(key, now, timeout=coalesce)
+
+        ForumLastRead.objects.bulk_create(
+            [ForumLastRead(user=user, thread=thread, created_at=now)],
+            update_conflicts=True,
+            unique_fields=["thread", "user"],
+            update_fields=["created_at"],
+        )
+
+    class Meta:
+        app_label = "forum"
+        unique_together = (("thread", "user"),)
+
+
+def bbcode_blob_path(instance: "BBCodeImageBlob", filename: str) -> str:
+    return "bbcode/{}/{}".format(instance.sha256[:2], filename)
+
+
+class BBCodeImageBlob(Model):
+    """Downloaded BBCode image file, stored once per distinct content and shared by all urls pointing to it."""
+
+    sha256 = CharField(max_length=64, unique=True, null=False)
+    created_at = DateTimeField(default=utc_now, null=False)
+    original = ImageField(upload_to=bbcode_blob_path, null=False)
+    medium = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=480, upscale=False)],
+        format="JPEG",
+        options={"quality": 90},
+    )
+    medium_webp = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=480, upscale=False)],
+        format="WEBP",
+        options={"quality": 85},
+    )
+    medium_avif = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=480, upscale=False)],
+        format="AVIF",
+        options={"quality": 70},
+    )
+    small = ImageSpecField(
+        source="original", processors=[ResizeToFit(width=120, height=120, upscale=True)], format="PNG"
+    )
+    small_webp = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=120, height=120, upscale=True)],
+        format="WEBP",
+        options={"quality": 85},
+    )
+    small_avif = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=120, height=120, upscale=True)],
+        format="AVIF",
+        options={"quality": 70},
+    )
+    renditions = JSONField(default=dict, blank=True, null=False)
+
+    rendition_source = "original"
+    rendition_specs = ("medium", "small")
+
+    def __str__(self) -> str:
+        return str(self.sha256)
+
+    def refresh_renditions(self) -> bool:
+        return refresh_renditions(self)
+
+    @staticmethod
+    def from_file(fd, ext: str) -> "BBCodeImageBlob":
+        """Returns the blob with the same content as the given file, storing the file if there is none yet"""
+        fd.seek(0)
+        digest = hashlib.file_digest(fd, "sha256").hexdigest()
+        fd.seek(0)
+        blob = BBCodeImageBlob.objects.filter(sha256=digest).first()
+        if blob:
+            return blob
+        blob = BBCodeImageBlob(sha256=digest)
+        name = "{}{}".format(digest, ext or "")
+        blob.original.save(name, File(fd, name), save=False)
         try:
-            ForumLastRead.objects.create(user=user, thread=thread, created_at=utc_now())
+            with transaction.atomic():
+                blob.save()
         except IntegrityError:
-            ForumLastRead.objects.filter(user=user, thread=thread).update(created_at=utc_now())
+            # Same content was stored concurrently by another worker
+            blob.original.delete(save=False)
+            return BBCodeImageBlob.objects.get(sha256=digest)
+        return blob
+
+    def delete_files(self) -> None:
+        for name in rendition_fields(self, all_variants=True):
+            image = getattr(self, name)
+            image.storage.delete(image.name)
+        self.original.delete(save=False)
 
     class Meta:
         app_label = "forum"
-        unique_together = (("thread", "user"),)
+        verbose_name = "BBCode Image Blob"
+        verbose_name_plural = "BBCode Image Blobs"
 
 
 class BBCodeImage(Model):
     source_url = URLField(db_index=True, unique=True, null=False)
     created_at = DateTimeField(default=utc_now, null=False)
-    original = ImageField(upload_to="bbcode", null=False)
+    blob = ForeignKey(BBCodeImageBlob, on_delete=PROTECT, null=True, blank=True, related_name="images")
+
+    # Per-url image files from before deduplication, see the dedupe_bbcode_images command
+    original = ImageField(upload_to="bbcode", blank=True, null=False)
     medium = ImageSpecField(
         source="original",
         processors=[ResizeToFit(width=480, upscale=False)],
@@ -350,7 +547,98 @@ class BBCodeImage(Model):
     def __str__(self) -> str:
         return str(self.source_url)
 
+    @property
+    def image(self) -> typing.Union[BBCodeImageBlob, "BBCodeImage"]:
+        """Object holding the image file and its renditions"""
+        return self.blob if self.blob_id else self
+
     class Meta:
         app_label = "forum"
         verbose_name = "BBCode Image"
         verbose_name_plural = "BBCode Images"
+
+
+class BBCodeImageReference(Model):
+    """Image urls embedded in BBCode texts, so that the texts can be re-rendered when a cached image changes"""
+
+    source_url = URLField(max_length=2048, null=False)
+    object_type = CharField(max_length=16, null=False)  # As in tasks.postprocess
+    object_id = PositiveIntegerField(null=False)
+
+    def __str__(self) -> str:
+        return "{} {}: {}".format(self.object_type, self.object_id, self.source_url)
+
+    @staticmethod
+    def update_for(object_type: str, object_id: int, urls: typing.Iterable[str]) -> None:
+        """Replace the references of an object with the given urls"""
+        urls = {url for url in urls if len(url) <= 2048}
+        refs = BBCodeImageReference.objects.filter(object_type=object_type, object_id=object_id)
+        existing = set(refs.values_list("source_url", flat=True))
+        if existing - urls:
+            refs.filter(source_url__in=existing - urls).delete()
+        if urls - existing:
+            BBCodeImageReference.objects.bulk_create(
+                [
+                    BBCodeImageReference(source_url=url, object_type=object_type, object_id=object_id)
+                    for url in urls - existing
+                ],
+                ignore_conflicts=True,
+            )
+
+    class Meta:
+        app_label = "forum"
+        unique_together = (("source_url", "object_type", "object_id"),)
+        indexes = [Index(fields=["object_type", "object_id"])]
+
+
+class BBCodeImageFailure(Model):
+    """Failed downloads of a BBCode image url. Only transient failures are retried."""
+
+    source_url = URLField(unique=True, null=False)
+    reason = CharField(max_length=255, blank=True, null=False)
+    attempts = PositiveIntegerField(default=0, null=False)
+    permanent = BooleanField(default=False, null=False)
+    created_at = DateTimeField(default=utc_now, null=False)
+    last_attempt_at = DateTimeField(default=utc_now, null=False)
+    next_retry_at = DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return str(self.source_url)
+
+    @staticmethod
+    def get_skipped_urls(urls: typing.Iterable[str]) -> typing.Set[str]:
+        """Returns the urls that should not be downloaded right now"""
+        return set(
+            BBCodeImageFailure.objects.filter(source_url__in=urls)
+            .filter(Q(permanent=True) | Q(next_retry_at__gt=utc_now()))
+            .values_list("source_url", flat=True)
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def record(url: str, reason: str, permanent: bool) -> "BBCodeImageFailure":
+        now = utc_now()
+        failure, _ = BBCodeImageFailure.objects.select_for_update().get_or_create(source_url=url)
+        failure.attempts += 1
+        failure.reason = reason[:255]
+        failure.permanent = permanent
+        failure.last_attempt_at = now
+        if permanent:
+            failure.next_retry_at = None
+        else:
+            delay = min(
+                settings.BBCODE_CACHE_RETRY_DELAY * 2 ** (failure.attempts - 1),
+                settings.BBCODE_CACHE_RETRY_MAX_DELAY,
+            )
+            failure.next_retry_at = now + timedelta(seconds=delay)
+        failure.save()
+        return failure
+
+    @staticmethod
+    def clear(url: str) -> None:
+        BBCodeImageFailure.objects.filter(source_url=url).delete()
+
+    class Meta:
+        app_label = "forum"
+        verbose_name = "BBCode Image Failure"
+        verbose_name_plural = "BBCode Image Failures"
@@ -0,0 +1,82 @@
+import typing
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import ForumBoard
+
+VERSION_KEY = "forum:board_access:version"
+CACHE_TIMEOUT = 3600
+
+
+class BoardAccess:
+    """Sets of board and section ids a user is allowed to read and write."""
+
+    def __init__(
+        self, readable: typing.Iterable[int], writable: typing.Iterable[int], sections: typing.Iterable[int]
+    ):
+        self.readable = frozenset(readable)
+        self.writable = frozenset(writable)
+        self.sections = frozenset(sections)
+
+    def can_read(self, board_id: int) -> bool:
+        return board_id in self.readable
+
+    def can_write(self, board_id: int) -> bool:
+        return board_id in self.writable
+
+    def can_read_section(self, section_id: int) -> bool:
+        return section_id in self.sections
+
+
+def get_permission_version() -> int:
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def bump_permission_version() -> None:
+    """Invalidates all cached board access sets."""
+    cache.add(VERSION_KEY, 1, timeout=None)
+    cache.incr(VERSION_KEY)
+
+
+def resolve_board_access(user: User) -> BoardAccess:
+    if not user.is_authenticated or not user.is_active:
+        perm_ids = set()
+    elif user.is_superuser:
+        perm_ids = None
+    else:
+        perm_ids = set(
+            Permission.objects.filter(Q(user=user) | Q(group__user=user)).values_list("id", flat=True)
+        )
+
+    readable, writable, sections = [], [], set()
+    boards = ForumBoard.objects.filter(deleted=False).values_list(
+        "id", "section_id", "read_perm_id", "write_perm_id"
+    )
+    for board_id, section_id, read_perm_id, write_perm_id in boards:
+        if read_perm_id is None or perm_ids is None or read_perm_id in perm_ids:
+            readable.append(board_id)
+            sections.add(section_id)
+        if user.is_authenticated and (
+            write_perm_id is None or perm_ids is None or write_perm_id in perm_ids
+        ):
+            writable.append(board_id)
+    return BoardAccess(readable, writable, sections)
+
+
+def get_board_access(user: User) -> BoardAccess:
+    """Returns the boards the user can read and write, cached by user and permission version"""
+    access = getattr(user, "_board_access", None)
+    if access is None:
+        if user.is_authenticated:
+            user_key = "{}:{:d}{:d}".format(user.id, user.is_superuser, user.is_active)
+        else:
+            user_key = "anon"
+        key = "forum:board_access:{}:{}".format(user_key, get_permission_version())
+        access = cache.get(key)
+        if access is None:
+            access = resolve_board_access(user)
+            cache.set(key, access, timeout=CACHE_TIMEOUT)
+        user._board_access = access
+    return access
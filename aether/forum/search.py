@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+
+from aether.main_site.models import NewsItem
+from aether.utils.search import search
+
+from .models import ForumPost
+from .permissions import get_board_access
+
+
+def search_posts(user: User, query: str) -> QuerySet:
+    """Posts matching the query in the boards readable by the user, best matches first"""
+    posts = ForumPost.objects.filter(
+        deleted=False, thread__deleted=False, thread__board__in=get_board_access(user).readable
+    )
+    return search(posts, query, fallback_fields=("message",))
+
+
+def search_news(query: str) -> QuerySet:
+    return search(NewsItem.objects.filter(deleted=False), query, fallback_fields=("header", "message"))
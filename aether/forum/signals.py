@@ -1,9 +1,77 @@
+from django.db import transaction
+
 from aether.forum import tasks
+from aether.forum.bbcode_images import image_url_cache
+from aether.forum.models import ForumBoard
+from aether.forum.permissions import bump_permission_version
+from aether.utils.renditions import needs_renditions
+from aether.utils.search import refresh_search_vector
+
+# Board fields that affect the readable/writable board sets
+ACCESS_FIELDS = {"section", "read_perm", "write_perm", "deleted"}
+
+# Thread fields that affect the thread ordering of board pages
+THREAD_ORDER_FIELDS = {"board", "sticky", "modified_at", "deleted"}
 
 
 def postprocess_forumuser(sender, instance, created, **kwargs):
     tasks.postprocess.apply_async(("forumuser", instance.id))
 
 
+def generate_forumuser_renditions(sender, instance, created, **kwargs):
+    if needs_renditions(instance):
+        tasks.generate_renditions.apply_async(("forumuser", instance.id))
+
+
+def generate_galleryimage_renditions(sender, instance, created, **kwargs):
+    if needs_renditions(instance):
+        tasks.generate_renditions.apply_async(("galleryimage", instance.id))
+
+
+def rerender_deleted_image(sender, instance, **kwargs):
+    # Texts embedding the image should point to the remote url again
+    image_url_cache.delete(instance.source_url)
+    transaction.on_commit(lambda: tasks.rerender_image_references.apply_async(([instance.source_url],)))
+
+
 def postprocess_forumpost(sender, instance, created, **kwargs):
     tasks.postprocess.apply_async(("forumpost", instance.id))
+
+
+def update_forumpost_search_vector(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and "message" not in update_fields:
+        return
+    refresh_search_vector(instance)
+
+
+def refresh_forumpost_counters(sender, instance, created, update_fields=None, **kwargs):
+    # Only creation and (un)deletion of posts affects the counters
+    if created:
+        if not instance.deleted:
+            instance.thread.count_new_post(instance)
+        return
+    if update_fields is not None and "deleted" not in update_fields:
+        return
+    # Visible posts are numbered and deleted ones are not, so a mismatch means a deletion or restore
+    if instance.deleted == (instance.post_number == 0):
+        return
+    with transaction.atomic():
+        instance.thread.refresh_counters()
+        instance.thread.refresh_post_number(instance)
+        instance.thread.board.refresh_counters()
+
+
+def invalidate_board_pages(sender, instance, update_fields=None, **kwargs):
+    # A thread moved away also changes the thread count of its previous board, which is a part of the key
+    if update_fields is not None and not THREAD_ORDER_FIELDS.intersection(update_fields):
+        return
+    ForumBoard.bump_page_version(instance.board_id)
+
+
+def invalidate_board_access(sender, action=None, update_fields=None, **kwargs):
+    # Called for board changes, group deletions and permission/group membership m2m changes
+    if action is not None and not action.startswith("post_"):
+        return
+    if update_fields is not None and not ACCESS_FIELDS.intersection(update_fields):
+        return
+    bump_permission_version()
@@ -1,39 +1,84 @@
-import io
 import logging
 import mimetypes
-import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from tempfile import NamedTemporaryFile
 from urllib import parse
 
 import requests
 from celery import shared_task
 from django.conf import settings
-from django.core.files import File
-from django.db import IntegrityError, transaction
-from django.utils import timezone
+from django.db.models import F
 from PIL import Image
 from precise_bbcode.bbcode import get_parser
+from requests.adapters import HTTPAdapter
 
-from aether.forum.models import BBCodeImage, ForumPost, ForumUser
+from aether.forum.bbcode_images import image_render_context, image_url_cache
+from aether.forum.models import (
+    BBCodeImage,
+    BBCodeImageBlob,
+    BBCodeImageFailure,
+    BBCodeImageReference,
+    ForumLastRead,
+    ForumPost,
+    ForumThread,
+    ForumUser,
+)
+from aether.gallery.models import GalleryImage
 from aether.main_site.models import NewsItem
+from aether.utils.renditions import needs_renditions
 
 log = logging.getLogger("tasks")
 
+# BBCode texts that can embed images, by object type: model, field name and cache version field
+BBCODE_OBJECTS = {
+    "newsitem": (NewsItem, "message", None),
+    "forumpost": (ForumPost, "message", "edit_version"),
+    "forumuser": (ForumUser, "signature", "profile_version"),
+}
+RERENDER_BATCH_SIZE = 100
+
+_session = None
+
 mimetypes.init()
 match_url = re.compile(r"\[img\](\s*)(.+?)(\s*)\[\/img\]")
 
 
 class DownloadFailedException(Exception):
-    pass
+    """Image could not be downloaded. Permanent failures are not worth retrying later."""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
 
+class DeadlineExceededException(DownloadFailedException):
+    """Download did not finish within the deadline. Says nothing about the image, so it is not recorded."""
 
-class ImageVerificationException(Exception):
-    pass
 
+class ImageVerificationException(DownloadFailedException):
+    def __init__(self, message, permanent=True):
+        super().__init__(message, permanent)
 
-def fetch_url_to_file(fd, url):
-    with requests.get(url, stream=True) as r:
+
+def get_session():
+    """Returns a per-process requests session, which keeps connections to remote hosts alive."""
+    global _session
+    if _session is None:
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=settings.BBCODE_CACHE_FETCH_PER_HOST,
+        )
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+
+def fetch_url_to_file(fd, url, deadline=None):
+    with get_session().get(url, stream=True, timeout=settings.BBCODE_CACHE_FETCH_TIMEOUT) as r:
         # Make sure response code is okay
         if r.status_code != requests.codes.ok:
             raise DownloadFailedException("Unexpected response code {}".format(r.status_code))
@@ -43,7 +88,9 @@ def fetch_url_to_file(fd, url):
             content_type = r.headers["Content-Type"]
             log.info("Content type is %s", content_type)
             if content_type not in settings.BBCODE_CACHE_IMAGE_MIME_TYPES:
-                raise DownloadFailedException("Image type {} is not acceptable".format(content_type))
+                raise DownloadFailedException(
+                    "Image type {} is not acceptable".format(content_type), permanent=True
+                )
 
         # Make sure that the reported content length is smaller than maximum
         if "Content-Length" in r.headers:
@@ -51,126 +98,280 @@ def fetch_url_to_file(fd, url):
             log.info("Content length is %d bytes", image_size)
             if image_size > settings.BBCODE_CACHE_IMAGE_MAX_SIZE:
                 raise DownloadFailedException(
-                    "Imagefile size exceeds maximum of {}".format(settings.BBCODE_CACHE_IMAGE_MAX_SIZE)
+                    "Imagefile size exceeds maximum of {}".format(settings.BBCODE_CACHE_IMAGE_MAX_SIZE),
+                    permanent=True,
                 )
 
         # Read data from remote host to a file, stop and fail if any problems
         done = 0
         for chunk in r.iter_content(chunk_size=4096):
+            if deadline and time.monotonic() > deadline:
+                raise DeadlineExceededException("Deadline exceeded")
             done += len(chunk)
             if done > settings.BBCODE_CACHE_IMAGE_MAX_SIZE:
                 raise DownloadFailedException(
-                    "Imagefile size exceeds maximum of {}".format(settings.BBCODE_CACHE_IMAGE_MAX_SIZE)
+                    "Imagefile size exceeds maximum of {}".format(settings.BBCODE_CACHE_IMAGE_MAX_SIZE),
+                    permanent=True,
                 )
             fd.write(chunk)
         fd.flush()
         fd.seek(0)
 
 
+# Pillow reports JPEG files with extra embedded images, as saved by many cameras, as MPO
+JPEG_FORMATS = ("JPEG", "MPO")
+
+
+def get_image_mime(img):
+    if img.format in JPEG_FORMATS:
+        return "image/jpeg"
+    return Image.MIME.get(img.format)
+
+
 def guess_image_extension(img):
-    ext = mimetypes.guess_extension(Image.MIME[img.format])
+    ext = mimetypes.guess_extension(get_image_mime(img))
     if ext == ".jpe":
         ext = ".jpg"
     return ext
 
 
 def verify_image(fd):
+    """Verify the downloaded image file, decoding as little of it as possible"""
     try:
-        img = Image.open(io.BytesIO(fd.read()))
-        img.load()
-        ext = guess_image_extension(img)
-        img.close()
-        fd.seek(0)
-        return ext
+        img = Image.open(fd)
     except Image.DecompressionBombError as e:
         raise ImageVerificationException("Decompression bomb detected!") from e
     except Exception as e:
         raise ImageVerificationException("Failed to open imagefile") from e
 
+    with img:
+        if get_image_mime(img) not in settings.BBCODE_CACHE_IMAGE_MIME_TYPES:
+            raise ImageVerificationException("Image format {} is not acceptable".format(img.format))
+        width, height = img.size
+        if width * height > settings.BBCODE_CACHE_IMAGE_MAX_PIXELS:
+            raise ImageVerificationException("Image dimensions {}x{} exceed maximum".format(width, height))
+        ext = guess_image_extension(img)
+        try:
+            if img.format == "PNG":
+                img.verify()
+            else:
+                if img.format in JPEG_FORMATS:
+                    img.draft(None, (max(width // 8, 1), max(height // 8, 1)))
+                img.load()
+        except Exception as e:
+            raise ImageVerificationException("Failed to decode imagefile") from e
+
+    fd.seek(0)
+    return ext
+
 
-def cache_bbcode_image(url):
+def download_bbcode_image(url, deadline=None):
+    """Download and verify an image. Returns an open temporary file and an extension."""
     log.info("Attempting to fetch {}".format(url))
     p = parse.urlparse(url)
 
     # Ensure that the url seems okay
     if p.scheme not in ["http", "https"]:
-        log.error("Unknown scheme %s", p.scheme, extra={"url": url})
-        return False
+        raise DownloadFailedException("Unknown scheme {}".format(p.scheme), permanent=True)
 
-    # Read content to a file. Spool to memory until 2M, then write to disk.
-    with NamedTemporaryFile() as fd:
-        # Download with requests
-        try:
-            fetch_url_to_file(fd, url)
-        except Exception as e:
-            log.exception("Unable to download source image", extra={"url": url}, exc_info=e)
-            return False
+    fd = NamedTemporaryFile()
 
-        # Verify with Pillow
-        try:
-            ext = verify_image(fd)
-        except Exception as e:
-            log.exception("Failed to verify image", extra={"url": url}, exc_info=e)
-            return False
+    # Download with requests, and verify with Pillow
+    try:
+        fetch_url_to_file(fd, url, deadline)
+        return fd, verify_image(fd)
+    except DownloadFailedException:
+        fd.close()
+        raise
+    except Exception as e:
+        fd.close()
+        raise DownloadFailedException("Unable to download source image: {}".format(e)) from e
 
-        # If this file already exists, overwrite it
-        try:
-            entry = BBCodeImage.objects.get(source_url=url)
-            entry.original.delete()
-        except BBCodeImage.DoesNotExist:
-            entry = BBCodeImage()
-            entry.source_url = url
-
-        # Add extension if one does not exist already
-        name = os.path.basename(p.path)
-        if name == "":
-            name = f"{timezone.now():%Y-%m-%d_%H-%M-%S}"
-        if os.path.splitext(name)[1] == "" and ext:
-            name = f"{name}{ext}"
-
-        # Add produced file
-        entry.original.save(name, File(fd, name), save=False)
-
-        # ... and then save everything
-        try:
-            entry.save()
-        except IntegrityError:
-            log.exception("Source url has already been downloaded. Concurrency issue ?")
-            return False
+
+def record_bbcode_image_failure(url, error):
+    log.warning("Failed to download image: %s", error, extra={"url": url})
+    failure = BBCodeImageFailure.record(url, str(error), error.permanent)
+    if failure.permanent:
+        log.info("Url %s will not be retried", url)
+    else:
+        log.info("Url %s will be retried after %s", url, failure.next_retry_at)
+
+
+def store_bbcode_image(url, fd, ext):
+    """Save a downloaded image file as the BBCodeImage for the url. Identical files are stored only once."""
+    blob = BBCodeImageBlob.from_file(fd, ext)
+    if needs_renditions(blob):
+        blob.refresh_renditions()
+    entry, created = BBCodeImage.objects.get_or_create(source_url=url, defaults={"blob": blob})
+    if not created:
+        # If this url was already downloaded, point it to the new content
+        if entry.original:
+            entry.original.delete(save=False)
+            entry.original = ""
+        entry.blob = blob
+        entry.save()
+
+    # Forget any previously resolved urls and failures for this image
+    image_url_cache.delete(url)
+    BBCodeImageFailure.clear(url)
 
     # Download part is done
-    log.info("Downloaded to %s.", entry.original.name)
+    log.info("Downloaded to %s.", blob.original.name)
     return True
 
 
-@transaction.atomic
-def postprocess_bbcode_img(model, object_id, field_name):
-    obj = model.objects.select_for_update().get(pk=object_id)
-    text = getattr(obj, field_name)
-    hits = match_url.findall(text.raw)
+def fetch_bbcode_images(urls):
+    """Download images concurrently. Returns url -> (file, extension) and url -> error dicts."""
+    deadline = time.monotonic() + settings.BBCODE_CACHE_FETCH_DEADLINE
+    host_limits = {
+        parse.urlparse(url).hostname: threading.BoundedSemaphore(settings.BBCODE_CACHE_FETCH_PER_HOST)
+        for url in urls
+    }
+
+    def close_result(future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            future.result()[0].close()
+
+    def fetch(url):
+        with host_limits[parse.urlparse(url).hostname]:
+            if time.monotonic() > deadline:
+                log.error("Deadline exceeded before fetching", extra={"url": url})
+                return None
+            return download_bbcode_image(url, deadline)
+
+    pool = ThreadPoolExecutor(max_workers=settings.BBCODE_CACHE_FETCH_WORKERS)
+    try:
+        futures = {pool.submit(fetch, url): url for url in urls}
+        done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        for future in not_done:
+            log.error("Deadline exceeded while fetching", extra={"url": futures[future]})
+            # The download may still finish in the background, and its temporary file must not leak
+            future.add_done_callback(close_result)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    results, failures = {}, {}
+    for future in done:
+        try:
+            result = future.result()
+        except DeadlineExceededException:
+            continue
+        except DownloadFailedException as e:
+            failures[futures[future]] = e
+        else:
+            if result is not None:
+                results[futures[future]] = result
+    return results, failures
+
+
+def rerender_bbcode(object_type, object_ids):
+    """Re-render the BBCode of the given objects, skipping rows edited meanwhile"""
+    model, field_name, version_field = BBCODE_OBJECTS[object_type]
+    raws = dict(model.objects.filter(pk__in=object_ids).values_list("pk", field_name))
+    parser = get_parser()
+    with image_render_context(*raws.values()):
+        rendered = {pk: parser.render(raw) for pk, raw in raws.items()}
+    updated = 0
+    for pk, raw in raws.items():
+        values = {"_{}_rendered".format(field_name): rendered[pk]}
+        if version_field:
+            values[version_field] = F(version_field) + 1
+        if model.objects.filter(pk=pk, **{field_name: raw}).update(**values):
+            updated += 1
+        else:
+            log.info("Object %s with pk=%s was changed during rendering, skipping", model.__name__, pk)
+    return updated
+
+
+def rerender_references(urls):
+    """Re-render all texts that embed any of the given image urls, in batches"""
+    refs = BBCodeImageReference.objects.filter(source_url__in=urls).values_list("object_type", "object_id")
+    by_type = {}
+    for object_type, object_id in refs.distinct():
+        by_type.setdefault(object_type, []).append(object_id)
+    for object_type, object_ids in by_type.items():
+        for n in range(0, len(object_ids), RERENDER_BATCH_SIZE):
+            rerender_bbcode(object_type, object_ids[n : n + RERENDER_BATCH_SIZE])
+        log.info("Re-rendered {} objects of type {}".format(len(object_ids), object_type))
+
+
+def postprocess_bbcode_img(object_type, object_id):
+    # Phase 1: Download images without holding a transaction or row locks open.
+    model, field_name, _ = BBCODE_OBJECTS[object_type]
+    raw = model.objects.filter(pk=object_id).values_list(field_name, flat=True).first()
+    if raw is None:
+        log.warning("Object %s with pk=%s no longer exists", model.__name__, object_id)
+        return
+    hits = match_url.findall(raw)
     urls = set([h[1] for h in hits])
-    if urls:
-        # Fetch urls to cache
-        refresh = False
-        for url in urls:
-            if BBCodeImage.objects.filter(source_url=url).exists():
-                log.warning("Source url %s is already loaded", url)
-                continue
-            if cache_bbcode_image(url):
-                refresh = True
-        if refresh:
-            # Re-render bbcode
-            model.objects.filter(id=obj.id).update(
-                **{"_{}_rendered".format(field_name): get_parser().render(text.raw)}
-            )
+    BBCodeImageReference.update_for(object_type, object_id, urls)
+    if not urls:
+        return
+
+    # Fetch urls to cache
+    stored = set()
+    loaded = set(BBCodeImage.objects.filter(source_url__in=urls).values_list("source_url", flat=True))
+    for url in loaded:
+        log.warning("Source url %s is already loaded", url)
+    skipped = BBCodeImageFailure.get_skipped_urls(urls - loaded)
+    for url in skipped:
+        log.info("Skipping url %s, it has failed recently", url)
+    results, failures = fetch_bbcode_images(urls - loaded - skipped)
+    for url, error in failures.items():
+        record_bbcode_image_failure(url, error)
+    for url, (fd, ext) in results.items():
+        with fd:
+            if store_bbcode_image(url, fd, ext):
+                stored.add(url)
+
+    # Phase 2: Re-render this and all other texts that embed the newly cached images.
+    if stored:
+        rerender_references(stored)
 
 
 @shared_task()
 def postprocess(object_type, object_id):
     log.info("Postprocessing object type {} with pk={}".format(object_type, object_id))
-    if object_type == "newsitem":
-        postprocess_bbcode_img(NewsItem, object_id, "message")
-    elif object_type == "forumpost":
-        postprocess_bbcode_img(ForumPost, object_id, "message")
-    elif object_type == "forumuser":
-        postprocess_bbcode_img(ForumUser, object_id, "signature")
+    postprocess_bbcode_img(object_type, object_id)
+
+
+@shared_task()
+def rerender_image_references(urls):
+    rerender_references(urls)
+
+
+@shared_task()
+def postprocess_many(object_type, object_ids):
+    for object_id in object_ids:
+        try:
+            postprocess(object_type, object_id)
+        except Exception:
+            log.exception("Postprocessing object type %s with pk=%s failed", object_type, object_id)
+
+
+@shared_task()
+def generate_renditions(object_type, object_id):
+    log.info("Generating renditions for object type {} with pk={}".format(object_type, object_id))
+    model = {"forumuser": ForumUser, "galleryimage": GalleryImage, "bbcodeimageblob": BBCodeImageBlob}[
+        object_type
+    ]
+    try:
+        obj = model.objects.get(pk=object_id)
+    except model.DoesNotExist:
+        log.warning("Object %s with pk=%s no longer exists", model.__name__, object_id)
+        return
+    if not obj.refresh_renditions():
+        log.info("Source image of %s with pk=%s was changed, skipping", model.__name__, object_id)
+
+
+@shared_task()
+def flush_thread_views():
+    count = ForumThread.flush_views()
+    if count:
+        log.info("Flushed view counters for {} threads".format(count))
+
+
+@shared_task()
+def prune_last_reads(user_id, before):
+    count, _ = ForumLastRead.objects.filter(user_id=user_id, created_at__lte=before).delete()
+    log.info("Pruned {} last read entries for user {}".format(count, user_id))
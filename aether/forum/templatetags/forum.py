@@ -1,18 +1,55 @@
 from django import template
 
+from aether.forum.permissions import get_board_access
+from aether.forum.unread import get_board_unread_counts
+from aether.utils.renditions import picture_html
+
 register = template.Library()
 
 
+class CachedPostNode(template.Node):
+    def __init__(self, nodelist, post, part):
+        self.nodelist = nodelist
+        self.post = post
+        self.part = part
+
+    def render(self, context):
+        post_cache = context.get("post_cache")
+        if post_cache is None:
+            return self.nodelist.render(context)
+        post = self.post.resolve(context)
+        part = self.part.resolve(context)
+        fragment = post_cache.get(post, part)
+        if fragment is None:
+            fragment = self.nodelist.render(context)
+            post_cache.set(post, part, fragment)
+        return fragment
+
+
+@register.tag
+def cached_post(parser, token):
+    """Usage: {% cached_post post "part" %} ... {% endcached_post %}"""
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError("'{}' tag requires post and part arguments".format(bits[0]))
+    nodelist = parser.parse(("endcached_post",))
+    parser.delete_first_token()
+    return CachedPostNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
+
+
 @register.filter
 def sections_readable_by(items, user):
-    return [x for x in items if x.can_read(user)]
+    access = get_board_access(user)
+    return [x for x in items if access.can_read_section(x.id)]
 
 
 @register.filter
 def boards_readable_by(section, user):
-    boards = [x for x in section.visible_boards(user) if x.can_read(user)]
+    boards = list(section.visible_boards().filter(id__in=get_board_access(user).readable))
+    unread_counts = get_board_unread_counts(user)
     latest_posts = section.get_latest_posts([x.latest_post_id for x in boards])
     for board in boards:
+        board.new_posts_count = unread_counts.get(board.id, 0)
         if board.latest_post_id is None:
             board.latest_post = None
         else:
@@ -22,9 +59,20 @@ def boards_readable_by(section, user):
 
 @register.filter
 def page_for(item, user):
-    return item.page_for(user, item.post_count)
+    return item.page_for(user)
 
 
 @register.filter
 def dict_get(d: dict, item: str):
     return d.get(item)
+
+
+@register.filter
+def elided_page_range(page, on_each_side: int = 3):
+    return page.paginator.get_elided_page_range(page.number, on_each_side=on_each_side, on_ends=2)
+
+
+@register.simple_tag
+def picture(renditions: dict, name: str, **attrs):
+    """Renders a <picture> element for a pre-generated rendition, eg. {% picture image.renditions "thumbnail" %}"""
+    return picture_html(renditions, name, **attrs)
@@ -0,0 +1,25 @@
+import io
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from aether.forum.tasks import verify_image
+
+
+def make_mpo_file():
+    # Two frames, like the JPEG and its preview image saved by many cameras
+    frames = [Image.new("RGB", (64, 48), color) for color in ("red", "blue")]
+    fd = io.BytesIO()
+    frames[0].save(fd, "MPO", save_all=True, append_images=frames[1:])
+    fd.seek(0)
+    return fd
+
+
+class VerifyImageTest(SimpleTestCase):
+    def test_mpo_is_accepted_as_jpeg(self):
+        fd = make_mpo_file()
+        with Image.open(fd) as img:
+            self.assertEqual(img.format, "MPO")
+        fd.seek(0)
+        self.assertEqual(verify_image(fd), ".jpg")
+        self.assertEqual(fd.tell(), 0)
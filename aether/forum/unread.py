@@ -0,0 +1,135 @@
+import logging
+import typing
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from redis.exceptions import RedisError
+
+from aether.forum import tasks
+from aether.forum.models import ForumLastRead, ForumThread
+from aether.forum.permissions import get_board_access
+from aether.utils.misc import get_redis_connection_or_none, utc_now
+
+log = logging.getLogger(__name__)
+
+# Read times from ForumLastRead, mirrored to a redis hash of thread id -> read timestamp per user
+HASH_KEY = "forum:unread:{}"
+HASH_SENTINEL = "built"
+HASH_TIMEOUT = 3600 * 24 * 30
+
+
+def get_watermark(user: User) -> datetime:
+    """Everything modified before this time is considered read"""
+    watermark = user.profile.last_all_read
+    if settings.FORUM_UNREAD_MAX_AGE:
+        watermark = max(watermark, utc_now() - timedelta(seconds=settings.FORUM_UNREAD_MAX_AGE))
+    return watermark
+
+
+def rebuild(user: User, conn=None) -> typing.Dict[int, datetime]:
+    """Rebuild the redis hash for the user from the database, and return the read times in it"""
+    conn = conn or get_redis_connection_or_none()
+    rows = ForumLastRead.objects.filter(user=user, created_at__gt=get_watermark(user)).values_list(
+        "thread_id", "created_at"
+    )
+    read_times = dict(rows)
+    if conn is not None:
+        key = HASH_KEY.format(user.id)
+        mapping = {thread_id: ts.timestamp() for thread_id, ts in read_times.items()}
+        mapping[HASH_SENTINEL] = 1
+        with conn.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, HASH_TIMEOUT)
+            pipe.execute()
+    return read_times
+
+
+def get_read_times(user: User, thread_ids: typing.List[int]) -> typing.Dict[int, datetime]:
+    """Returns the last read times of the given threads. Threads without a read time are omitted."""
+    if not thread_ids:
+        return {}
+    conn = get_redis_connection_or_none()
+    if conn is not None:
+        try:
+            values = conn.hmget(HASH_KEY.format(user.id), [HASH_SENTINEL] + thread_ids)
+            if values[0] is None:
+                read_times = rebuild(user, conn)
+                return {k: read_times[k] for k in thread_ids if k in read_times}
+            return {
+                thread_id: datetime.fromtimestamp(float(value), timezone.utc)
+                for thread_id, value in zip(thread_ids, values[1:])
+                if value is not None
+            }
+        except RedisError:
+            log.exception("Unable to read unread state from redis, falling back to database")
+    rows = ForumLastRead.objects.filter(user=user, thread_id__in=thread_ids).values_list(
+        "thread_id", "created_at"
+    )
+    return dict(rows)
+
+
+def mark_thread_read(user: User, thread: ForumThread) -> None:
+    ForumLastRead.refresh_last_read(user, thread)
+    conn = get_redis_connection_or_none()
+    if conn is None:
+        return
+    try:
+        # If the hash does not exist, this creates one without the sentinel; it gets rebuilt on next read.
+        conn.hset(HASH_KEY.format(user.id), thread.id, utc_now().timestamp())
+    except RedisError:
+        log.exception("Unable to write unread state to redis")
+
+
+def mark_all_read(user: User) -> None:
+    user.profile.mark_all_read()
+    conn = get_redis_connection_or_none()
+    if conn is not None:
+        try:
+            key = HASH_KEY.format(user.id)
+            with conn.pipeline() as pipe:
+                pipe.delete(key)
+                pipe.hset(key, HASH_SENTINEL, 1)
+                pipe.expire(key, HASH_TIMEOUT)
+                pipe.execute()
+        except RedisError:
+            log.exception("Unable to reset unread state in redis")
+
+    # Rows older than the watermark no longer matter, so they can be cleaned up later.
+    tasks.prune_last_reads.apply_async((user.id, user.profile.last_all_read.isoformat()))
+
+
+def annotate_threads(user: User, threads: typing.Iterable[ForumThread]) -> None:
+    """Sets new_posts_count (1 or 0) for a page of threads"""
+    threads = list(threads)
+    if not user.is_authenticated:
+        for thread in threads:
+            thread.new_posts_count = 0
+        return
+    watermark = get_watermark(user)
+    candidates = [x.id for x in threads if x.modified_at > watermark]
+    read_times = get_read_times(user, candidates)
+    for thread in threads:
+        read_at = read_times.get(thread.id, watermark)
+        thread.new_posts_count = int(thread.modified_at > max(read_at, watermark))
+
+
+def get_board_unread_counts(user: User) -> typing.Dict[int, int]:
+    """Returns the number of unread threads of each readable board that has any"""
+    counts = getattr(user, "_board_unread_counts", None)
+    if counts is not None:
+        return counts
+    counts = {}
+    if user.is_authenticated:
+        watermark = get_watermark(user)
+        threads = ForumThread.objects.filter(
+            board__in=get_board_access(user).readable, deleted=False, modified_at__gt=watermark
+        ).values_list("id", "board_id", "modified_at")
+        threads = list(threads)
+        read_times = get_read_times(user, [x[0] for x in threads])
+        for thread_id, board_id, modified_at in threads:
+            if modified_at > read_times.get(thread_id, watermark):
+                counts[board_id] = counts.get(board_id, 0) + 1
+    user._board_unread_counts = counts
+    return counts
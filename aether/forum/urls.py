@@ -6,6 +6,7 @@ app_name = "forum"
 
 urlpatterns = [
     path("", views.boards, name="boards"),
+    path("search/", views.search, name="search"),
     path("mark_all_read/", views.mark_all_read, name="mark_all_read"),
     path("<int:board_id>/", views.threads, name="threads"),
     path("<int:board_id>/<int:thread_id>/", views.posts, name="posts"),
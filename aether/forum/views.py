@@ -1,16 +1,23 @@
+from urllib.parse import urlencode
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required, permission_required
 from django.core.paginator import Paginator
-from django.db.models import F
+from django.db import transaction
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
 from django.views.decorators.cache import never_cache
 
 from aether.utils.misc import get_page
+from aether.utils.pagination import KeysetPaginator
 
+from . import unread
 from .forms import EditMessageForm, MoveThreadForm, NewMessageForm, NewThreadForm
-from .models import ForumBoard, ForumLastRead, ForumPost, ForumSection, ForumThread
+from .fragment_cache import PostFragmentCache
+from .models import ForumBoard, ForumPost, ForumSection, ForumThread
+from .permissions import get_board_access
+from .search import search_news, search_posts
 
 
 @never_cache
@@ -21,19 +28,18 @@ def boards(request):
 
 @never_cache
 def threads(request, board_id):
+    access = get_board_access(request.user)
+    if not access.can_read(board_id):
+        raise Http404
     try:
-        board = ForumBoard.objects.select_related(
-            "read_perm", "read_perm__content_type", "write_perm", "write_perm__content_type"
-        ).get(pk=board_id, deleted=False)
+        board = ForumBoard.objects.get(pk=board_id, deleted=False)
     except ForumBoard.DoesNotExist:
         raise Http404
-    if not board.can_read(request.user):
-        raise Http404
 
     if request.method == "POST":
         if not request.user.is_authenticated:
             raise Http404
-        if not board.can_write(request.user):
+        if not access.can_write(board.id):
             raise Http404
         form = NewThreadForm(request.POST, user=request.user, board=board)
         if form.is_valid():
@@ -45,9 +51,21 @@ def threads(request, board_id):
     show_count = (
         request.user.profile.thread_limit if request.user.is_authenticated else settings.FORUM_THREAD_LIMIT
     )
-    paginator = Paginator(board.visible_threads(request.user), show_count)
+    if settings.FORUM_KEYSET_PAGINATION:
+        paginator = KeysetPaginator(
+            board.visible_threads(),
+            show_count,
+            keys=["-sticky", "-modified_at", "id"],
+            count=board.thread_count,
+            cache_key="forum:pages:board:{}:{}:{}:{}:{}".format(
+                board.id, show_count, board.thread_count, board.latest_post_id, board.get_page_version()
+            ),
+        )
+    else:
+        paginator = Paginator(board.visible_threads(), show_count)
     page = get_page(request)
     thread_list = paginator.get_page(page)
+    unread.annotate_threads(request.user, thread_list)
     latest_posts = board.get_latest_posts([x.latest_post_id for x in list(thread_list)])
 
     return render(
@@ -58,7 +76,7 @@ def threads(request, board_id):
             "threads": thread_list,
             "latest_posts": latest_posts,
             "can_manage": request.user.has_perm("forum.can_manage_boards"),
-            "can_write": board.can_write(request.user),
+            "can_write": access.can_write(board.id),
             "form": form,
         },
     )
@@ -67,21 +85,17 @@ def threads(request, board_id):
 @never_cache
 def posts(request, board_id, thread_id):
     try:
-        thread = ForumThread.objects.select_related(
-            "board__read_perm",
-            "board__read_perm__content_type",
-            "board__write_perm",
-            "board__write_perm__content_type",
-        ).get(pk=thread_id, deleted=False)
+        thread = ForumThread.objects.select_related("board").get(pk=thread_id, deleted=False)
     except ForumThread.DoesNotExist:
         raise Http404
-    if not thread.board.can_read(request.user):
+    access = get_board_access(request.user)
+    if not access.can_read(thread.board_id):
         raise Http404
 
     if request.method == "POST":
         if not request.user.is_authenticated:
             raise Http404
-        if not thread.board.can_write(request.user):
+        if not access.can_write(thread.board_id):
             raise Http404
         if thread.closed:
             raise Http404
@@ -100,28 +114,49 @@ def posts(request, board_id, thread_id):
 
     # Refresh last viewed values for this user/thread
     if request.user.is_authenticated:
-        ForumLastRead.refresh_last_read(request.user, thread)
+        unread.mark_thread_read(request.user, thread)
 
-    # Update the views counter atomically
-    ForumThread.objects.filter(pk=thread.pk).update(views=F("views") + 1)
+    # Update the views counter. This is buffered to redis, and written out periodically.
+    ForumThread.add_view(thread.pk)
 
     show_count = (
         request.user.profile.message_limit if request.user.is_authenticated else settings.FORUM_MESSAGE_LIMIT
     )
-    paginator = Paginator(thread.visible_posts, show_count)
+    if settings.FORUM_KEYSET_PAGINATION:
+        paginator = KeysetPaginator(
+            thread.visible_posts,
+            show_count,
+            keys=["id"],
+            count=thread.post_count,
+            cache_key="forum:pages:thread:{}:{}:{}:{}".format(
+                thread.id, show_count, thread.post_count, thread.latest_post_id
+            ),
+        )
+    else:
+        paginator = Paginator(thread.visible_posts, show_count)
     page = get_page(request)
+    post_list = paginator.get_page(page)
 
-    return render(
+    # Rendered post blocks are cached, fetch them all at once
+    post_cache = None
+    if settings.FORUM_POST_CACHE_TIMEOUT:
+        post_cache = PostFragmentCache(post_list, parts=("author", "body", "signature"))
+
+    response = render(
         request,
         "forum/posts.html",
         {
             "thread": thread,
             "form": form,
-            "posts": paginator.get_page(page),
+            "posts": post_list,
+            "post_cache": post_cache,
             "can_manage": request.user.has_perm("forum.can_manage_boards"),
-            "can_write": thread.board.can_write(request.user),
+            "can_write": access.can_write(thread.board_id),
         },
     )
+    if post_cache:
+        post_cache.save_stats()
+    return response
 
 
 @login_required
@@ -134,7 +169,7 @@ def edit_post(request, board_id, thread_id, post_id):
     # User must have write rights to the board
     if not (request.user.has_perm("forum.can_manage_boards") or post.user.id == request.user.id):
         raise Http404
-    if not thread.board.can_write(request.user):
+    if not get_board_access(request.user).can_write(thread.board_id):
         raise Http404
 
     if request.method == "POST":
@@ -176,8 +211,10 @@ def toggle_closed(request, board_id, thread_id):
 @permission_required("forum.can_manage_boards")
 def delete_thread(request, board_id, thread_id):
     thread = get_object_or_404(ForumThread, pk=thread_id, board_id=board_id, deleted=False)
-    thread.deleted = True
-    thread.save()
+    with transaction.atomic():
+        thread.deleted = True
+        thread.save()
+        thread.board.refresh_counters()
     return HttpResponseRedirect(reverse("forum:threads", args=(board_id,)))
 
 
@@ -197,7 +234,24 @@ def move_thread(request, board_id, thread_id):
     return render(request, "forum/move_thread.html", {"form": form, "thread": thread})
 
 
+@never_cache
+def search(request):
+    query = request.GET.get("q", "").strip()
+    posts = None
+    news = []
+    if query:
+        posts = search_posts(request.user, query).select_related("thread", "user", "user__profile")
+        posts = Paginator(posts, settings.FORUM_SEARCH_LIMIT).get_page(get_page(request))
+        if posts.number == 1:
+            news = search_news(query)[:5]
+    return render(
+        request,
+        "forum/search.html",
+        {"query": query, "page_query": urlencode({"q": query}) + "&", "posts": posts, "news": news},
+    )
+
+
 @login_required
 def mark_all_read(request):
-    request.user.profile.mark_all_read(request.user)
+    unread.mark_all_read(request.user)
     return HttpResponseRedirect(reverse("forum:boards"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("gallery", "0002_auto_20210616_2216"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="galleryimage",
+            name="renditions",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
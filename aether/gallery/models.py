@@ -5,6 +5,7 @@ from django.db.models import (
     DateTimeField,
     ForeignKey,
     ImageField,
+    JSONField,
     Model,
     TextField,
 )
@@ -13,6 +14,7 @@ from imagekit.processors import ResizeToFit
 from precise_bbcode.fields import BBCodeTextField
 
 from aether.utils.misc import utc_now
+from aether.utils.renditions import refresh_renditions
 
 
 class GalleryGroup(Model):
@@ -41,10 +43,29 @@ class GalleryImage(Model):
     thumbnail = ImageSpecField(
         source="original", processors=[ResizeToFit(width=200, height=200, upscale=True)], format="PNG"
     )
+    thumbnail_webp = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=200, height=200, upscale=True)],
+        format="WEBP",
+        options={"quality": 85},
+    )
+    thumbnail_avif = ImageSpecField(
+        source="original",
+        processors=[ResizeToFit(width=200, height=200, upscale=True)],
+        format="AVIF",
+        options={"quality": 70},
+    )
+    renditions = JSONField(default=dict, blank=True, null=False)  # See forum.tasks.generate_renditions
+
+    rendition_source = "original"
+    rendition_specs = ("thumbnail",)
 
     def __str__(self) -> str:
         return "{}: {}".format(self.group.name, self.name)
 
+    def refresh_renditions(self) -> bool:
+        return refresh_renditions(self)
+
     class Meta:
         app_label = "gallery"
         verbose_name = "Gallery Image"
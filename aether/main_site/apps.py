@@ -7,6 +7,7 @@ class MainsiteConfig(AppConfig):
 
     def ready(self):
         from .models import NewsItem
-        from .signals import postprocess_newsitem
+        from .signals import postprocess_newsitem, update_newsitem_search_vector
 
         post_save.connect(postprocess_newsitem, sender=NewsItem)
+        post_save.connect(update_newsitem_search_vector, sender=NewsItem)
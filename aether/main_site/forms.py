@@ -14,6 +14,7 @@ from django.forms import CharField, EmailField, ModelForm, ValidationError
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from aether.forum.bbcode_images import image_render_context
 from aether.forum.models import ForumUser
 
 
@@ -122,7 +123,9 @@ class ProfileForm(ModelForm):
         self.user.email = self.cleaned_data["email"]
         self.user.save()
         timezone.activate(str(self.cleaned_data["timezone"]))
-        ret = super(ProfileForm, self).save(*args, **kwargs)
+        self.instance.profile_version += 1
+        with image_render_context(self.cleaned_data["signature"]):
+            ret = super(ProfileForm, self).save(*args, **kwargs)
         return ret
 
     class Meta:
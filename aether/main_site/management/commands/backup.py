@@ -1,28 +1,69 @@
+import hashlib
+import json
 import os
 import tarfile
 import time
 from datetime import datetime
 from io import BytesIO, TextIOWrapper
+from itertools import islice
 
+from django.apps import apps
 from django.conf import settings
+from django.core import serializers
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+from aether.utils.backups import (
+    COMPRESSORS,
+    BackupError,
+    get_media_arcname,
+    open_tar_writer,
+)
+
+BACKUP_APPS = ("auth", "forum", "gallery", "main_site")
+
+# Imagekit renditions can be regenerated from the originals, so they are not backed up
+SKIPPED_MEDIA_DIRS = ("CACHE",)
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("-d", "--dir", dest="dir", type=str, help="Output directory")
+        parser.add_argument(
+            "--streaming",
+            action="store_true",
+            help="Dump each model as chunked NDJSON members instead of a single database.json",
+        )
+        parser.add_argument(
+            "--chunk-rows", type=int, default=10000, help="Rows per NDJSON member in streaming mode"
+        )
+        parser.add_argument(
+            "-c",
+            "--compress",
+            choices=sorted(COMPRESSORS),
+            default="gzip",
+            help="Compression method. pigz and zstd run as external multi-threaded processes.",
+        )
+        parser.add_argument(
+            "--threads", type=int, default=os.cpu_count(), help="Compression threads for pigz and zstd"
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only archive media files that have changed since the previous incremental backup",
+        )
+        parser.add_argument(
+            "--full", action="store_true", help="Start a new incremental chain with all media files"
+        )
+        parser.add_argument(
+            "--manifest",
+            type=str,
+            help="Media manifest file (default: media_manifest.json in the output dir)",
+        )
 
     @staticmethod
-    def generate_db_backup(tar):
-        fd = BytesIO()
-        wrapper = TextIOWrapper(
-            fd,
-            encoding="utf-8",
-            write_through=True,
-        )
-        call_command("dumpdata", "auth", "forum", "gallery", "main_site", "-a", "-v2", stdout=wrapper)
-        tarinfo = tarfile.TarInfo("database.json")
+    def add_member(tar, name, fd):
+        tarinfo = tarfile.TarInfo(name)
         fd.seek(0, os.SEEK_END)
         tarinfo.size = fd.tell()
         fd.seek(0)
@@ -31,11 +72,121 @@ class Command(BaseCommand):
         tarinfo.mtime = time.time()
         tar.addfile(tarinfo, fd)
 
+    def generate_db_backup(self, tar):
+        fd = BytesIO()
+        wrapper = TextIOWrapper(
+            fd,
+            encoding="utf-8",
+            write_through=True,
+        )
+        call_command("dumpdata", *BACKUP_APPS, "-a", "-v2", stdout=wrapper)
+        self.add_member(tar, "database.json", fd)
+
+    def generate_streaming_db_backup(self, tar, chunk_rows):
+        """Dump every model to jsonl members of at most chunk_rows objects each"""
+        for app_label in BACKUP_APPS:
+            for model in apps.get_app_config(app_label).get_models():
+                started = time.monotonic()
+                label = model._meta.label_lower
+                queryset = model._base_manager.order_by(model._meta.pk.name)
+                m2m_fields = [field.name for field in model._meta.many_to_many]
+                if m2m_fields:
+                    queryset = queryset.prefetch_related(*m2m_fields)
+                rows = queryset.iterator(chunk_size=min(chunk_rows, 2000))
+
+                count = 0
+                number = 0
+                while True:
+                    chunk = list(islice(rows, chunk_rows))
+                    if not chunk:
+                        break
+                    fd = BytesIO(serializers.serialize("jsonl", chunk).encode("utf-8"))
+                    self.add_member(tar, "database/{}/{:06d}.jsonl".format(label, number), fd)
+                    count += len(chunk)
+                    number += 1
+                print("{}: {} rows in {:.1f}s".format(label, count, time.monotonic() - started))
+
+    @staticmethod
+    def skip_cache(tarinfo):
+        parts = tarinfo.name.split("/")
+        if len(parts) > 1 and parts[1] in SKIPPED_MEDIA_DIRS:
+            return None
+        return tarinfo
+
+    @staticmethod
+    def walk_media():
+        """Yields the relative path and os.stat() of every backed up media file"""
+        for root, dirs, files in os.walk(settings.MEDIA_ROOT):
+            if os.path.normpath(root) == os.path.normpath(settings.MEDIA_ROOT):
+                dirs[:] = [d for d in dirs if d not in SKIPPED_MEDIA_DIRS]
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, settings.MEDIA_ROOT), os.stat(path)
+
+    def generate_incremental_media_backup(self, tar, previous):
+        """Archive media files changed since the previous manifest. Returns the new manifest entries."""
+        files = {}
+        changed = []
+        for rel, st in self.walk_media():
+            old = previous["files"].get(rel)
+            if old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+                files[rel] = old
+                continue
+            with open(os.path.join(settings.MEDIA_ROOT, rel), "rb") as fd:
+                digest = hashlib.file_digest(fd, "sha256").hexdigest()
+            files[rel] = [st.st_size, st.st_mtime_ns, digest]
+            if not old or old[2] != digest:
+                changed.append(rel)
+        deleted = sorted(previous["files"].keys() - files.keys())
+
+        # The increment description comes first, so that restore can check the chain before extracting
+        info = {"base": previous["backup"], "deleted": deleted}
+        self.add_member(tar, "media_increment.json", BytesIO(json.dumps(info).encode("utf-8")))
+        arcname = get_media_arcname()
+        for rel in changed:
+            tar.add(
+                os.path.join(settings.MEDIA_ROOT, rel), arcname="{}/{}".format(arcname, rel), recursive=False
+            )
+        print("Media: {} changed, {} deleted, {} total files".format(len(changed), len(deleted), len(files)))
+        return files
+
     def handle(self, *args, **options):
+        extension, _ = COMPRESSORS[options["compress"]]
         output_dir = options["dir"]
-        filename = os.path.join(output_dir, f"{datetime.now():aether_backup_%Y-%m-%d_%H-%M-%S}.tar.gz")
+        filename = os.path.join(output_dir, f"{datetime.now():aether_backup_%Y-%m-%d_%H-%M-%S}{extension}")
         print(f"Saving to {filename}")
 
-        with tarfile.open(filename, mode="w:gz") as tar:
-            self.generate_db_backup(tar)
-            tar.add(settings.MEDIA_ROOT, arcname=os.path.basename(settings.MEDIA_ROOT))
+        manifest_path = options["manifest"] or os.path.join(output_dir, "media_manifest.json")
+        previous = {"backup": None, "files": {}}
+        if options["incremental"] and not options["full"] and os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as fd:
+                previous = json.load(fd)
+
+        started = time.monotonic()
+        try:
+            with open_tar_writer(filename, options["compress"], options["threads"]) as tar:
+                db_started = time.monotonic()
+                if options["streaming"]:
+                    self.generate_streaming_db_backup(tar, options["chunk_rows"])
+                else:
+                    self.generate_db_backup(tar)
+                print("Database: {:.1f}s".format(time.monotonic() - db_started))
+
+                media_started = time.monotonic()
+                if options["incremental"]:
+                    files = self.generate_incremental_media_backup(tar, previous)
+                else:
+                    tar.add(settings.MEDIA_ROOT, arcname=get_media_arcname(), filter=self.skip_cache)
+                print("Media: {:.1f}s".format(time.monotonic() - media_started))
+        except BackupError as e:
+            raise CommandError(str(e)) from e
+
+        # Only save the manifest once the archive is complete
+        if options["incremental"]:
+            manifest = {"backup": os.path.basename(filename), "files": files}
+            with open(manifest_path + ".tmp", "w", encoding="utf-8") as fd:
+                json.dump(manifest, fd)
+            os.replace(manifest_path + ".tmp", manifest_path)
+
+        print("Backup done in {:.1f}s".format(time.monotonic() - started))
@@ -0,0 +1,238 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.apps import apps
+from django.core import serializers
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+
+from aether.forum.models import ForumBoard
+from aether.forum.permissions import bump_permission_version
+from aether.utils.backups import BackupError, open_tar_reader
+
+
+def init_worker():
+    django.setup()
+    connections.close_all()
+
+
+def get_dependencies(model, models: set) -> set:
+    """Restored models the given model refers to with foreign keys"""
+    return {
+        field.related_model
+        for field in model._meta.concrete_fields
+        if field.is_relation and field.related_model in models and field.related_model is not model
+    }
+
+
+def get_load_levels(models: list) -> list:
+    """Group models into units loaded in one transaction, and the units into parallel levels"""
+    models = set(models)
+    reachable = {model: get_dependencies(model, models) for model in models}
+    changed = True
+    while changed:
+        changed = False
+        for model, targets in reachable.items():
+            extended = targets.union(*(reachable[x] for x in targets))
+            if extended != targets:
+                reachable[model] = extended
+                changed = True
+
+    units = {
+        model: frozenset({model} | {x for x in reachable[model] if model in reachable[x]})
+        for model in models
+    }
+    levels = {}
+
+    def get_level(unit):
+        if unit not in levels:
+            deps = {units[x] for model in unit for x in get_dependencies(model, models)} - {unit}
+            levels[unit] = 1 + max((get_level(x) for x in deps), default=-1)
+        return levels[unit]
+
+    grouped = defaultdict(set)
+    for unit in set(units.values()):
+        grouped[get_level(unit)].add(unit)
+    return [
+        sorted(sorted(model._meta.label_lower for model in unit) for unit in grouped[level])
+        for level in sorted(grouped)
+    ]
+
+
+def copy_objects(model, objects) -> None:
+    """Load objects with PostgreSQL COPY"""
+    fields = model._meta.concrete_fields
+    qn = connection.ops.quote_name
+    sql = "COPY {} ({}) FROM STDIN".format(
+        qn(model._meta.db_table), ", ".join(qn(field.column) for field in fields)
+    )
+    with connection.cursor() as cursor, cursor.copy(sql) as copy:
+        for obj in objects:
+            copy.write_row(
+                [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+            )
+
+
+def read_spooled(spool_dir: str, label: str, counts: dict, relations: list):
+    """Yields the spooled objects of a model, counting them and collecting their m2m relations"""
+    for name in sorted(os.listdir(os.path.join(spool_dir, label))):
+        with open(os.path.join(spool_dir, label, name), "r", encoding="utf-8") as fd:
+            for item in serializers.deserialize("jsonl", fd, ignorenonexistent=True):
+                counts[label] += 1
+                for field_name, values in item.m2m_data.items():
+                    relations.append((label, field_name, item.object.pk, values))
+                yield item.object
+
+
+def load_models(labels: list, spool_dir: str, batch_size: int) -> tuple:
+    """Load the spooled rows of the given models in one transaction, without sending signals"""
+    counts = {}
+    relations = []
+    with transaction.atomic():
+        for label in labels:
+            model = apps.get_model(label)
+            counts[label] = 0
+            rows = read_spooled(spool_dir, label, counts, relations)
+            if connection.vendor == "postgresql":
+                copy_objects(model, rows)
+            else:
+                while batch := list(islice(rows, batch_size)):
+                    model._base_manager.bulk_create(batch)
+    return counts, relations
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore the database from a backup archive made with the backup command. All existing rows in the "
+        "restored tables are deleted. Media files are restored with restore_media."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive", help="Backup archive")
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Do not prompt for confirmation",
+        )
+        parser.add_argument("--workers", type=int, default=4, help="Number of tables loaded in parallel")
+        parser.add_argument(
+            "--batch-size", type=int, default=2000, help="Rows per insert when COPY is not available"
+        )
+
+    @staticmethod
+    def spool_archive(filename: str, spool_dir: str) -> list:
+        """Extract the database rows into NDJSON files per model. Returns the model labels."""
+        labels = set()
+        with open_tar_reader(filename) as tar:
+            for member in tar:
+                if member.name == "database.json":
+                    by_label = defaultdict(list)
+                    for row in json.load(tar.extractfile(member)):
+                        by_label[row["model"]].append(row)
+                    for label, rows in by_label.items():
+                        os.makedirs(os.path.join(spool_dir, label), exist_ok=True)
+                        with open(
+                            os.path.join(spool_dir, label, "000000.jsonl"), "w", encoding="utf-8"
+                        ) as fd:
+                            fd.writelines(json.dumps(row) + "\n" for row in rows)
+                        labels.add(label)
+                elif member.name.startswith("database/") and member.isfile():
+                    _, label, name = member.name.split("/")
+                    os.makedirs(os.path.join(spool_dir, label), exist_ok=True)
+                    with open(os.path.join(spool_dir, label, name), "wb") as fd:
+                        shutil.copyfileobj(tar.extractfile(member), fd)
+                    labels.add(label)
+                elif labels:
+                    # Media files come after the database, and are not needed here
+                    break
+        return sorted(labels)
+
+    @staticmethod
+    def get_m2m_through_models(models: list) -> list:
+        return [
+            field.remote_field.through
+            for model in models
+            for field in model._meta.local_many_to_many
+            if field.remote_field.through._meta.auto_created
+        ]
+
+    def flush_tables(self, models: list) -> None:
+        tables = [model._meta.db_table for model in models + self.get_m2m_through_models(models)]
+        sql_list = connection.ops.sql_flush(no_style(), tables, allow_cascade=True)
+        connection.ops.execute_sql_flush(sql_list)
+
+    @staticmethod
+    def load_relations(relations: list, batch_size: int) -> None:
+        with transaction.atomic():
+            for label, field_name, pk, values in relations:
+                field = apps.get_model(label)._meta.get_field(field_name)
+                through = field.remote_field.through
+                source = "{}_id".format(field.m2m_field_name())
+                target = "{}_id".format(field.m2m_reverse_field_name())
+                rows = [through(**{source: pk, target: value}) for value in values]
+                through._base_manager.bulk_create(rows, batch_size=batch_size)
+
+    def handle(self, *args, **options):
+        if options["interactive"]:
+            confirm = input(
+                "This will DELETE all existing rows in the tables restored from {}.\n"
+                "Type 'yes' to continue, or 'no' to cancel: ".format(options["archive"])
+            )
+            if confirm != "yes":
+                print("Restore cancelled.")
+                return
+
+        started = time.monotonic()
+        with tempfile.TemporaryDirectory(prefix="aether_restore_") as spool_dir:
+            try:
+                labels = self.spool_archive(options["archive"], spool_dir)
+            except BackupError as e:
+                raise CommandError(str(e)) from e
+            if not labels:
+                raise CommandError("No database found in {}".format(options["archive"]))
+            try:
+                models = [apps.get_model(label) for label in labels]
+            except LookupError as e:
+                raise CommandError(str(e)) from e
+            print("Read {} tables in {:.1f}s".format(len(models), time.monotonic() - started))
+
+            self.flush_tables(models)
+
+            # Close connections so that worker processes do not share them
+            connections.close_all()
+            relations = []
+            with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as pool:
+                for level in get_load_levels(models):
+                    futures = [
+                        pool.submit(load_models, unit, spool_dir, options["batch_size"]) for unit in level
+                    ]
+                    for future in futures:
+                        counts, unit_relations = future.result()
+                        relations.extend(unit_relations)
+                        for label, count in counts.items():
+                            print("{}: {} rows".format(label, count))
+
+        self.load_relations(relations, options["batch_size"])
+
+        # Explicit primary keys were inserted, so the sequences must be moved past them
+        sql_list = connection.ops.sequence_reset_sql(
+            no_style(), models + self.get_m2m_through_models(models)
+        )
+        with connection.cursor() as cursor:
+            for sql in sql_list:
+                cursor.execute(sql)
+
+        with transaction.atomic():
+            ForumBoard.rebuild_all_counters()
+        bump_permission_version()
+        print("Restore done in {:.1f}s".format(time.monotonic() - started))
@@ -0,0 +1,64 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from aether.utils.backups import BackupError, get_media_arcname, open_tar_reader
+
+
+class Command(BaseCommand):
+    help = "Restore media files from a full backup and the incremental backups made after it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("archives", nargs="+", help="Backup archives, starting from the full backup")
+
+    @staticmethod
+    def delete_files(paths):
+        root = os.path.realpath(settings.MEDIA_ROOT)
+        for rel in paths:
+            path = os.path.realpath(os.path.join(root, rel))
+            if os.path.commonpath([root, path]) != root:
+                raise CommandError("Refusing to delete {} outside of MEDIA_ROOT".format(rel))
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def restore_archive(self, filename, base):
+        """Extract media files from one archive, and return the deleted files of the increment"""
+        prefix = get_media_arcname() + "/"
+        info = None
+        count = 0
+        with open_tar_reader(filename) as tar:
+            for member in tar:
+                if member.name == "media_increment.json":
+                    info = json.load(tar.extractfile(member))
+                    if info["base"] != base:
+                        raise CommandError(
+                            "{} is based on {}, expected {}".format(
+                                filename, info["base"], base or "a full backup"
+                            )
+                        )
+                elif member.name.startswith(prefix) and not member.isdir():
+                    # Media members come after the increment info, so the chain is verified by now
+                    if info is None and base is not None:
+                        raise CommandError("{} is not an incremental backup".format(filename))
+                    member.name = member.name[len(prefix) :]
+                    tar.extract(member, settings.MEDIA_ROOT, filter="data")
+                    count += 1
+        if info is None:
+            if base is not None:
+                raise CommandError("{} is not an incremental backup".format(filename))
+            info = {"base": None, "deleted": []}
+        print("{}: {} files restored, {} deleted".format(filename, count, len(info["deleted"])))
+        return info["deleted"]
+
+    def handle(self, *args, **options):
+        base = None
+        try:
+            for filename in options["archives"]:
+                deleted = self.restore_archive(filename, base)
+                self.delete_files(deleted)
+                base = os.path.basename(filename)
+        except BackupError as e:
+            raise CommandError(str(e)) from e
+        print("Done. Run generate_renditions --force to rebuild the image renditions.")
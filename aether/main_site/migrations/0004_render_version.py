@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main_site", "0003_alter_newsitem_id"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="newsitem",
+            name="render_version",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:04
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The GIN index is created concurrently so that the table is not locked while it is built. Full-text
+# search is only available on PostgreSQL, so other databases do not get the index.
+INDEX_NAME = "main_site_newsitem_search_vector_gin"
+INDEX_TABLE = "main_site_newsitem"
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} USING gin (search_vector)".format(
+            INDEX_NAME, INDEX_TABLE
+        )
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("main_site", "0004_render_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="newsitem",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
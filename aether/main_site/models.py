@@ -1,7 +1,11 @@
+import typing
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db.models import BooleanField, CharField, DateTimeField, Index, Model
 from precise_bbcode.fields import BBCodeTextField
 
 from aether.utils.misc import utc_now
+from aether.utils.search import strip_bbcode
 
 
 class NewsItem(Model):
@@ -11,10 +15,19 @@ class NewsItem(Model):
     created_at = DateTimeField(null=False, default=utc_now)
     modified_at = DateTimeField(null=False, default=utc_now)
     deleted = BooleanField(default=False, null=False)
+    render_version = CharField(max_length=16, blank=True, default="")  # Set by regenerate_bbcode
+    search_vector = SearchVectorField(null=True, editable=False)  # Set on save, see aether.utils.search
 
     def __str__(self):
         return self.header
 
+    @staticmethod
+    def get_search_texts(header: str, message: str) -> typing.List[typing.Tuple[str, str]]:
+        return [(header, "A"), (strip_bbcode(message), "B")]
+
+    def search_texts(self) -> typing.List[typing.Tuple[str, str]]:
+        return self.get_search_texts(self.header, self.message.raw)
+
     class Meta:
         app_label = "main_site"
         indexes = [
@@ -1,5 +1,12 @@
 from aether.forum import tasks
+from aether.utils.search import refresh_search_vector
 
 
 def postprocess_newsitem(sender, instance, created, **kwargs):
     tasks.postprocess.apply_async(("newsitem", instance.id))
+
+
+def update_newsitem_search_vector(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not {"header", "message"}.intersection(update_fields):
+        return
+    refresh_search_vector(instance)
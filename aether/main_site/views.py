@@ -11,7 +11,7 @@ from .models import NewsItem
 
 
 def index(request):
-    news_items = NewsItem.objects.filter(deleted=False).order_by("-id")
+    news_items = NewsItem.objects.filter(deleted=False).defer("search_vector").order_by("-id")
 
     paginator = Paginator(news_items, 10)
     page = get_page(request)
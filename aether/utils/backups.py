@@ -0,0 +1,68 @@
+import contextlib
+import os
+import shutil
+import subprocess
+import tarfile
+
+from django.conf import settings
+
+# Output file extension and external compressor command for each compression method
+COMPRESSORS = {
+    "gzip": (".tar.gz", None),
+    "none": (".tar", None),
+    "pigz": (".tar.gz", ["pigz", "-c", "-p", "{threads}"]),
+    "zstd": (".tar.zst", ["zstd", "-q", "-c", "-T{threads}"]),
+}
+
+
+class BackupError(Exception):
+    pass
+
+
+def get_media_arcname() -> str:
+    """Directory name of media files in backup archives"""
+    return os.path.basename(os.path.normpath(settings.MEDIA_ROOT))
+
+
+@contextlib.contextmanager
+def open_tar_writer(filename: str, compress: str, threads: int):
+    """Open a tar archive for writing, compressed by an external process for pigz and zstd"""
+    _, command = COMPRESSORS[compress]
+    if command and not shutil.which(command[0]):
+        raise BackupError("{} is not installed".format(command[0]))
+
+    with open(filename, "wb") as out:
+        process = None
+        if command:
+            args = [arg.format(threads=max(threads, 1)) for arg in command]
+            process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=out)
+            fileobj, mode = process.stdin, "w|"
+        else:
+            fileobj, mode = out, "w:gz" if compress == "gzip" else "w"
+        try:
+            with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+                yield tar
+        finally:
+            if process:
+                process.stdin.close()
+                process.wait()
+        if process and process.returncode != 0:
+            raise BackupError("{} failed with exit code {}".format(command[0], process.returncode))
+
+
+@contextlib.contextmanager
+def open_tar_reader(filename: str):
+    """Open a backup archive for reading its members in order"""
+    if filename.endswith(".zst"):
+        if not shutil.which("zstd"):
+            raise BackupError("zstd is not installed")
+        process = subprocess.Popen(["zstd", "-q", "-d", "-c", filename], stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+                yield tar
+        finally:
+            process.stdout.close()
+            process.wait()
+    else:
+        with tarfile.open(filename, mode="r|*") as tar:
+            yield tar
@@ -1,6 +1,10 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone
 
 from django.db.models import IntegerField, Subquery
+from django_redis import get_redis_connection
 
 
 def get_page(request):
@@ -17,3 +21,42 @@ class SQCount(Subquery):
 
 def utc_now():
     return datetime.now(timezone.utc)
+
+
+def get_redis_connection_or_none():
+    try:
+        return get_redis_connection("default")
+    except NotImplementedError:  # Cache backend is not redis, eg. in development
+        return None
+
+
+class LRUCache:
+    """Small thread-safe in-process LRU cache with a maximum entry age"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
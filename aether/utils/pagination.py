@@ -0,0 +1,59 @@
+import typing
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+
+class KeysetPaginator(Paginator):
+    """Paginator that seeks by cached key values instead of OFFSET. The keys must make the order unique."""
+
+    BOUNDARY_CACHE_TIMEOUT = 300
+
+    def __init__(
+        self, object_list: QuerySet, per_page: int, keys: typing.List[str], count: int, cache_key: str
+    ):
+        super().__init__(object_list.order_by(*keys), per_page)
+        self.keys = keys
+        self.cache_key = cache_key
+        self._count = count
+
+    @cached_property
+    def count(self) -> int:
+        return self._count
+
+    def _load_boundaries(self) -> list:
+        fields = [key.lstrip("-") for key in self.keys]
+        rows = self.object_list.values_list(*fields).iterator()
+        return [row for n, row in enumerate(rows) if n % self.per_page == 0]
+
+    def get_boundaries(self, number: int) -> list:
+        boundaries = cache.get(self.cache_key)
+        if boundaries is None or len(boundaries) < number:
+            boundaries = self._load_boundaries()
+            cache.set(self.cache_key, boundaries, timeout=self.BOUNDARY_CACHE_TIMEOUT)
+        return boundaries
+
+    def seek_filter(self, boundary: tuple) -> Q:
+        """Build a filter that matches the boundary row and everything after it in the ordering"""
+        condition = Q()
+        equal = {}
+        for n, (key, value) in enumerate(zip(self.keys, boundary)):
+            field = key.lstrip("-")
+            last = n == len(self.keys) - 1
+            if key.startswith("-"):
+                op = "lte" if last else "lt"
+            else:
+                op = "gte" if last else "gt"
+            condition |= Q(**equal, **{"{}__{}".format(field, op): value})
+            equal[field] = value
+        return condition
+
+    def page(self, number):
+        number = self.validate_number(number)
+        boundaries = self.get_boundaries(number)
+        if len(boundaries) < number:
+            return self._get_page([], number, self)
+        qs = self.object_list.filter(self.seek_filter(boundaries[number - 1]))[: self.per_page]
+        return self._get_page(list(qs), number, self)
@@ -0,0 +1,72 @@
+import typing
+
+from django.conf import settings
+from django.db.models import Model
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+# Modern format variants of renditions as (spec field suffix, mime type), in order of preference
+VARIANTS = (("_avif", "image/avif"), ("_webp", "image/webp"))
+
+
+def rendition_fields(instance: Model, all_variants: bool = False) -> typing.List[str]:
+    """Returns the imagekit spec fields of the renditions and their enabled format variants"""
+    suffixes = ["", "_webp"]
+    if settings.IMAGE_RENDITION_AVIF or all_variants:
+        suffixes.append("_avif")
+    return [name + suffix for name in instance.rendition_specs for suffix in suffixes]
+
+
+def generate_renditions(instance: Model) -> dict:
+    """Generate the renditions of a model instance, and return their urls and dimensions"""
+    source = getattr(instance, instance.rendition_source)
+    renditions = {"source": source.name or ""}
+    if not source:
+        return renditions
+    for name in rendition_fields(instance):
+        file = getattr(instance, name)
+        file.generate()
+        try:
+            renditions[name] = {"url": file.url, "width": file.width, "height": file.height}
+        finally:
+            file.close()
+    return renditions
+
+
+def needs_renditions(instance: Model) -> bool:
+    source = getattr(instance, instance.rendition_source).name or ""
+    if instance.renditions.get("source", "") != source:
+        return True
+    return bool(source) and any(name not in instance.renditions for name in rendition_fields(instance))
+
+
+def refresh_renditions(instance: Model, **extra_values) -> bool:
+    """Store the renditions of the instance, unless its source image was replaced meanwhile"""
+    renditions = generate_renditions(instance)
+    updated = (
+        type(instance)
+        .objects.filter(pk=instance.pk, **{instance.rendition_source: renditions["source"]})
+        .update(renditions=renditions, **extra_values)
+    )
+    if updated:
+        instance.renditions = renditions
+    return bool(updated)
+
+
+def picture_html(renditions: dict, name: str, **attrs) -> str:
+    """Returns <picture> markup for the named rendition and its format variants, if it exists"""
+    image = renditions.get(name)
+    if not image:
+        return ""
+    sources = [
+        format_html('<source srcset="{}" type="{}">', renditions[name + suffix]["url"], mime)
+        for suffix, mime in VARIANTS
+        if name + suffix in renditions
+    ]
+    img_attrs = {"src": image["url"], "width": image.get("width"), "height": image.get("height")}
+    img_attrs.update(attrs)
+    img_attrs.setdefault("alt", "")
+    img_attrs.setdefault("loading", "lazy")
+    img_attrs = {k: v for k, v in img_attrs.items() if v is not None}
+    return format_html("<picture>{}<img{}></picture>", mark_safe("".join(sources)), flatatt(img_attrs))
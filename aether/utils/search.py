@@ -0,0 +1,56 @@
+import re
+import typing
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, Q, QuerySet, Value
+
+# Tags are dropped but their contents are kept as text, except for image urls which are not useful words
+BBCODE_IMAGE_RE = re.compile(r"\[img(?:=[^\]]*)?\].*?\[/img\]", re.IGNORECASE | re.DOTALL)
+BBCODE_TAG_RE = re.compile(r"\[/?[a-z*]+(?:=[^\]]*)?\]", re.IGNORECASE)
+
+
+def strip_bbcode(text: str) -> str:
+    return BBCODE_TAG_RE.sub(" ", BBCODE_IMAGE_RE.sub(" ", text))
+
+
+def is_supported() -> bool:
+    """Full-text search is only available on PostgreSQL"""
+    return connection.vendor == "postgresql"
+
+
+def build_search_vector(weighted_texts: typing.Iterable[typing.Tuple[str, str]]):
+    """Build a weighted tsvector expression from (text, weight) pairs"""
+    vector = None
+    for text, weight in weighted_texts:
+        part = SearchVector(Value(text), weight=weight, config=settings.SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def refresh_search_vector(instance) -> None:
+    """Store the search vector of a model instance, as given by its search_texts() method"""
+    if not is_supported():
+        return
+    type(instance)._base_manager.filter(pk=instance.pk).update(
+        search_vector=build_search_vector(instance.search_texts())
+    )
+
+
+def search(queryset: QuerySet, query: str, fallback_fields: typing.Iterable[str]) -> QuerySet:
+    """Filter a queryset by a web search style query, best matches first"""
+    queryset = queryset.defer("search_vector")
+    if not is_supported():
+        condition = Q()
+        for field in fallback_fields:
+            condition |= Q(**{"{}__icontains".format(field): query})
+        return (
+            queryset.filter(condition).annotate(rank=Value(0.0, output_field=FloatField())).order_by("-id")
+        )
+    search_query = SearchQuery(query, search_type="websearch", config=settings.SEARCH_CONFIG)
+    return (
+        queryset.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F("search_vector"), search_query))
+        .order_by("-rank", "-id")
+    )